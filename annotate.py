@@ -23,16 +23,19 @@ def get_entry(args, dao):
                       "{args.id}. to add a new target, use the --add flag.")
             exit(0)
 
-        def save(entry):
-            dao.write_entry(args.id, entry)
+        def save(entry, src=True):
+            """ only the target section, and the source one if `src` """
+            dao.write_lang(args.id, entry, lang_tgt, src)
+            commit(dao)
     elif args.new:
         lang_src = input("source language: ")
         entry = data.Entry(data.Text(lang_src, ask_for_text()))
         lang_tgt = input("target language: ")
         entry.add(data.Text(lang_tgt, ask_for_text()))
 
-        def save(entry):
+        def save(entry, src=True):
             dao.add_entry(entry)
+            commit(dao)
     else:
         print("Nothing to be done")
         exit(0)
@@ -40,6 +43,12 @@ def get_entry(args, dao):
     return entry, lang_tgt, save
 
 
+def commit(dao):
+    """ DAOs writing on commit only, as JsonDAO, would lose the session """
+    if hasattr(dao, "commit"):
+        dao.commit()
+
+
 def tokenize_src(text):
     return text.split()
 
@@ -69,6 +78,9 @@ if __name__ == "__main__":
     parser.add_argument("--id", default=None)
     parser.add_argument("--add", action="store_true")
     parser.add_argument("--new", action="store_true")
+    parser.add_argument("--record", default=None,
+                        help="write the keys of the session to this file, "
+                        "to replay it with bench_annotater.py --keys")
     args = parser.parse_args()
 
     entry, lang_tgt, save = get_entry(args, data.DAO)
@@ -77,17 +89,29 @@ if __name__ == "__main__":
     text_tgt = entry.get_text(lang_tgt)
     tokens_src = text_src.tokens
     tokens_tgt = text_tgt.tokens
+    tokens_src_read = list(tokens_src)  # the annotater edits the lists
 
     if not tokens_src:
         tokens_src = tokenize_src(text_src.str)
     if not tokens_tgt:
         tokens_tgt = tokenize_tgt(text_tgt.str)
-    tokens_src, tokens_tgt, map_ = annotater.process_manually(
-        tokens_src, tokens_tgt, entry.get_map(lang_tgt)
-    )
+    record = None if args.record is None else open(args.record, "w")
+    try:
+        tokens_src, tokens_tgt, map_ = annotater.process_manually(
+            tokens_src, tokens_tgt, entry.get_map(lang_tgt), record=record
+        )
+    finally:
+        if record is not None:
+            record.close()
+    src_changed = tokens_src != tokens_src_read
     text_src.set_tokens(tokens_src)
     entry.get_text(lang_tgt).set_tokens(tokens_tgt)
     entry.set(lang_tgt, map_=map_)
 
     if input("Save? [y/N]") in ("y", "Y"):
-        save(entry)
+        try:
+            save(entry, src_changed)
+        except data.RevisionConflictError:
+            print(f"entry {args.id} was modified since it was read, "
+                  "not saved.")
+            exit(1)
@@ -1,8 +1,13 @@
+import array
+import bisect
+import collections
 import curses
+import itertools
 import os
 import enum
 import tempfile
 import subprocess
+import time
 
 
 class Status(enum.Enum):
@@ -34,42 +39,109 @@ def get_color_map():
     return color_map
 
 
-def find_first(xs, cond, fail_return):
-    for i, x in enumerate(xs):
-        if cond(x):
-            return i, x
-    return fail_return
+STATUSES = tuple(Status)  # by value
 
 
 class Sentence:
     """ Representation of a sequence of words/tokens, aimed at helping
     visualisation for processing (e.g tagging) in cli. Each token has a status,
-    listed in `word_status`.
+    stored as a bytearray of Status values, along with the sorted indexes of
+    selected words and of non fixed words.
     Attr `active` represents a cursor position on the sequence, can be used to
     move around the sequence and update words status.
+    Changes are recorded until `pop_changes`, for redrawing only what changed.
     """
     def __init__(self, words, words_status=None, active=0):
         self.words = words
+        self._changed = set()  # indexes of words whose status changed
+        self._changed_from = 0  # words from this index on changed, or None
+        self._edits = []  # (word idx, 1 if inserted or -1 if deleted)
         self.words_status = ([Status.normal for _ in self.words]
                              if words_status is None else words_status)
         self.active = active
+        # char index of each word (and of the end) in " ".join(words) + " ",
+        # computed up to where it is needed
+        self._offsets = array.array("q", [0])
+
+    def _offsets_upto(self, word_idx):
+        offsets = self._offsets
+        for i in range(len(offsets) - 1, min(word_idx, len(self.words))):
+            offsets.append(offsets[i] + len(self.words[i]) + 1)
+        return offsets
+
+    def _words_changed(self, word_idx=0, step=None):
+        """ offsets from `word_idx` on are to be recomputed. `step` is 1 if
+        a word was inserted there, -1 if deleted, None if all the words from
+        there on changed """
+        del self._offsets[word_idx + 1:]
+        if step is not None and self._changed_from is None:
+            self._edits.append((word_idx, step))
+            self._changed = ({i + (i >= word_idx) for i in self._changed}
+                             if step > 0 else
+                             {i - (i > word_idx) for i in self._changed
+                              if i != word_idx})
+        else:
+            self._changed_from = (word_idx if self._changed_from is None
+                                  else min(word_idx, self._changed_from))
+
+    def pop_changes(self):
+        """ (indexes of words whose status changed, index from which words
+        changed or None, [(word idx, 1 if inserted or -1 if deleted)])
+        since last call """
+        changes = self._changed, self._changed_from, self._edits
+        self._changed = set()
+        self._changed_from = None
+        self._edits = []
+        return changes
 
     @property
     def char_len(self):
-        return sum(list(map(lambda w: len(w) + 1, self.words)))
+        return self._offsets_upto(len(self.words))[len(self.words)]
+
+    @property
+    def words_status(self):
+        return [STATUSES[s] for s in self._status]
+
+    @words_status.setter
+    def words_status(self, words_status):
+        self._status = bytearray(s.value for s in words_status)
+        self._changed.update(range(len(self._status)))
+        self._selected = [i for i, s in enumerate(self._status)
+                          if s == Status.selected.value]
+        self._nofixed = [i for i, s in enumerate(self._status)
+                         if s != Status.fixed.value]
+
+    def status(self, idx):
+        return STATUSES[self._status[idx]]
+
+    def _set_status(self, idx, status):
+        """ keep the sorted `_selected` and `_nofixed` in line with the
+        statuses """
+        old = self._status[idx]
+        new = status.value
+        if old == new:
+            return
+        self._status[idx] = new
+        self._changed.add(idx)
+        if old == Status.selected.value:
+            del self._selected[bisect.bisect_left(self._selected, idx)]
+        elif new == Status.selected.value:
+            bisect.insort(self._selected, idx)
+        if old == Status.fixed.value:
+            bisect.insort(self._nofixed, idx)
+        elif new == Status.fixed.value:
+            del self._nofixed[bisect.bisect_left(self._nofixed, idx)]
 
     @property
     def selected_words(self):
-        return [self.words[i] for i, s in enumerate(self.words_status)
-                if s == Status.selected]
+        return [self.words[i] for i in self._selected]
 
     @property
     def selected_idxs(self):
-        return [i for i, s in enumerate(self.words_status)
-                if s == Status.selected]
+        return list(self._selected)
 
     def closest_nofixed(self, idx, distinct=False):
-        if self.words_status[idx] is not Status.fixed and not distinct:
+        if self.status(idx) is not Status.fixed and not distinct:
             return idx
         else:
             idx_next = self.next_nofixed(idx)
@@ -87,73 +159,81 @@ class Sentence:
 
     def next(self, idx=None):
         idx = self.active if idx is None else idx
-        return min(len(self.words), idx + 1)
+        return min(len(self.words) - 1, idx + 1)
 
     def prev(self, idx=None):
         idx = self.active if idx is None else idx
         return max(0, idx - 1)
 
     def next_nofixed(self, idx=None):
+        """ the first non fixed word after idx, or idx if none """
         idx = self.active if idx is None else idx
-        i, _ = find_first(self.words_status[idx + 1:],
-                          lambda status: status is not Status.fixed,
-                          (-1, None))
-        return idx + i + 1
+        i = bisect.bisect_right(self._nofixed, idx)
+        return self._nofixed[i] if i < len(self._nofixed) else idx
 
     def prev_nofixed(self, idx=None):
+        """ the last non fixed word before idx, or idx if none """
         idx = self.active if idx is None else idx
-        idxs = [s for i, s in enumerate(self.words_status) if i < idx]
-        i, _ = find_first(idxs[::-1],
-                          lambda status: status is not Status.fixed,
-                          (-1, None))
-        return idx - i - 1
+        i = bisect.bisect_left(self._nofixed, idx)
+        return self._nofixed[i - 1] if i > 0 else idx
 
     def add_to_selection(self, *idxs):
         for idx in idxs:
-            st = self.words_status[idx]
+            st = self.status(idx)
             if st is not Status.fixed:
-                self.words_status[idx] = (Status.normal if st is Status.selected
-                                          else Status.selected)
+                self._set_status(idx, Status.normal if st is Status.selected
+                                 else Status.selected)
 
     def clear_selection(self):
-        def _process(s):
-            return Status.normal if s == Status.selected else s
-        self.words_status = list(map(_process, self.words_status))
+        for idx in list(self._selected):
+            self._set_status(idx, Status.normal)
 
     def clear_statuses(self):
         self.words_status = [Status.normal for _ in self.words]
 
     def fix_selection(self):
-        def _process(s):
-            return Status.fixed if s == Status.selected else s
-        self.words_status = list(map(_process, self.words_status))
+        for idx in list(self._selected):
+            self._set_status(idx, Status.fixed)
 
     def unselect(self, *idxs):
-        def _process(i_s):
-            idx, s = i_s
-            if idx in idxs:
-                return Status.normal if s == Status.selected else s
-            return s
-        self.words_status = list(map(_process, enumerate(self.words_status)))
+        for idx in idxs:
+            if self.status(idx) is Status.selected:
+                self._set_status(idx, Status.normal)
 
     def unfix(self, *idxs):
-        def _process(i_s):
-            idx, s = i_s
-            if idx in idxs:
-                return Status.selected if s == Status.fixed else s
-            return s
-        self.words_status = list(map(_process, enumerate(self.words_status)))
+        for idx in idxs:
+            if self.status(idx) is Status.fixed:
+                self._set_status(idx, Status.selected)
+
+    def set_statuses(self, idxs, status):
+        for idx in idxs:
+            self._set_status(idx, status)
 
     def word_at_char(self, char_idx):
-        total = 0
-        for i, word in enumerate(self.words):
-            total += len(word) + 1
-            if total > char_idx:
-                return i
-        return len(self.words) - 1
+        offsets = self._offsets_upto(len(self.words))
+        return min(bisect.bisect_right(offsets, char_idx) - 1,
+                   len(self.words) - 1)
 
     def char_at_word(self, word_idx):
-        return sum(list(map(lambda w: len(w) + 1, self.words[:word_idx])))
+        word_idx = min(word_idx, len(self.words))
+        return self._offsets_upto(word_idx)[word_idx]
+
+    def delete_word(self, word_idx):
+        self.words.pop(word_idx)
+        del self._status[word_idx]
+        self._selected = [i - (i > word_idx) for i in self._selected
+                          if i != word_idx]
+        self._nofixed = [i - (i > word_idx) for i in self._nofixed
+                         if i != word_idx]
+        self._words_changed(word_idx, -1)
+
+    def insert_word(self, word_idx, word):
+        self.words.insert(word_idx, word)
+        self._status.insert(word_idx, Status.normal.value)
+        self._selected = [i + (i >= word_idx) for i in self._selected]
+        i = bisect.bisect_left(self._nofixed, word_idx)
+        self._nofixed[i:] = [word_idx] + [j + 1 for j in self._nofixed[i:]]
+        self._words_changed(word_idx, 1)
 
     def split(self):
         text = " ".join(self.words)
@@ -172,108 +252,601 @@ class Sentence:
         words = text_out.split()
         if self.words != words:
             self.words = words
-            self.words_status = [Status.normal for _ in self.words]
+            self.clear_statuses()
+            self._words_changed()
             return True
         return False
 
 
-def delete_word(sent_idx, word_idx, sentences, mapping):
-    sentences[sent_idx].words.pop(word_idx)
-    sentences[sent_idx].words_status.pop(word_idx)
-
-    current_mapping = []
-    for i, corresp in enumerate(mapping.current):
-        selection = corresp[sent_idx]
-        if word_idx not in selection:
-            new_corresp = list(corresp)
-            new_corresp[sent_idx] = [j - 1 if j > word_idx else j
-                                     for j in selection]
-            current_mapping.append(new_corresp)
+def replay(deltas, sentences):
+    """ apply to `sentences` the `deltas` applied to a Mapping: words of
+    added groups are fixed, words of removed groups back to normal """
+    for op, *args in deltas:
+        if op == "add" or op == "remove":
+            _, group = args
+            status = Status.fixed if op == "add" else Status.normal
+            for selection, sentence in zip(group, sentences):
+                sentence.set_statuses(selection, status)
+        elif op == "delete_word":
+            side, word_idx, _ = args
+            sentences[side].delete_word(word_idx)
+        elif op == "insert_word":
+            side, word_idx, word = args
+            sentences[side].insert_word(word_idx, word)
 
-    mapping._current = current_mapping
 
+def delete_word(sent_idx, word_idx, sentences, mapping):
+    """ delete a word, and the group holding it """
+    deltas = mapping.delete_word(sent_idx, word_idx,
+                                 sentences[sent_idx].words[word_idx])
     for sentence in sentences:
-        sentence.clear_statuses()
+        sentence.clear_selection()
+    replay(deltas, sentences)
 
-    for corresp in mapping.current:
-        for selection, sentence in zip(corresp, sentences):
-            sentence.add_to_selection(*selection)
-            sentence.fix_selection()
+
+def undo(sentences, mapping, redo=False):
+    deltas = mapping.redo() if redo else mapping.undo()
+    if deltas is not None:
+        for sentence in sentences:
+            sentence.clear_selection()
+        replay(deltas, sentences)
+    return deltas is not None
 
 
 class Mapping:
-    def __init__(self, map_):
-        self.source = tuple(map_)
-        self._current = list(self.source)
+    """ Groups of aligned words, `(idxs0, idxs1)`, by id, with for each side
+    an index of the group of every word (-1 if none). Ids grow with each
+    added group, and are kept sorted to give the order of the groups.
+    Changes are made of deltas, logged to be undone and redone:
+        ("add", group id, group), ("remove", group id, group),
+        ("delete_word", side, word idx, word),
+        ("insert_word", side, word idx, word)
+    """
+    INVERSE = {"add": "remove", "remove": "add",
+               "delete_word": "insert_word", "insert_word": "delete_word"}
+
+    def __init__(self, map_, sizes=(0, 0)):
+        self.groups = {}
+        self._ids = []  # sorted
+        self.index = tuple(array.array("i", [-1]) * size for size in sizes)
+        self._next_id = 0
+        self._undo = []  # lists of deltas, one per change
+        self._redo = []
+        self._current = None
+        self._repr = None
+        for group in map_:
+            self._apply(("add", self._new_id(), group))
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id - 1
 
     @property
     def current(self):
-        return tuple(self._current)
+        if self._current is None:
+            self._current = tuple(self.groups[gid] for gid in self._ids)
+        return self._current
+
+    def __repr__(self):
+        if self._repr is None:
+            self._repr = repr(self.current)
+        return self._repr
+
+    def repr_tail(self, n_chars):
+        """ the end of repr(self), more than `n_chars` long if possible, from
+        the last groups only """
+        parts = []
+        size = 0
+        for gid in reversed(self._ids):
+            if size > n_chars:
+                return ", ".join(reversed(parts)) + ")"
+            parts.append(repr(self.groups[gid]))
+            size += len(parts[-1]) + 2
+        return repr(self)
+
+    def __len__(self):
+        return len(self.groups)
+
+    def group_of(self, side, word_idx):
+        """ id of the group holding a word, or -1 """
+        index = self.index[side]
+        return index[word_idx] if word_idx < len(index) else -1
+
+    def _shift(self, side, word_idx, step):
+        """ renumber the words from `word_idx` on, by `step` """
+        index = self.index[side]
+        for gid in set(index[word_idx:]) - {-1}:
+            selection = self.groups[gid][side]
+            selection[:] = [j + step if j >= word_idx else j
+                            for j in selection]
+
+    def _apply(self, delta):
+        op, *args = delta
+        if op == "add":
+            gid, group = args
+            group = self.groups[gid] = tuple(list(s) for s in group)
+            bisect.insort(self._ids, gid)
+            for index, selection in zip(self.index, group):
+                if selection and max(selection) >= len(index):
+                    index.extend([-1] * (max(selection) + 1 - len(index)))
+                for j in selection:
+                    index[j] = gid
+        elif op == "remove":
+            gid, _ = args
+            del self._ids[bisect.bisect_left(self._ids, gid)]
+            for index, selection in zip(self.index, self.groups.pop(gid)):
+                for j in selection:
+                    index[j] = -1
+        elif op == "delete_word":
+            side, word_idx, _ = args
+            self._shift(side, word_idx + 1, -1)
+            if word_idx < len(self.index[side]):
+                self.index[side].pop(word_idx)
+        elif op == "insert_word":
+            side, word_idx, _ = args
+            self._shift(side, word_idx, 1)
+            if word_idx <= len(self.index[side]):
+                self.index[side].insert(word_idx, -1)
+        self._current = self._repr = None
+
+    def _do(self, deltas):
+        for delta in deltas:
+            self._apply(delta)
+        self._undo.append(deltas)
+        self._redo.clear()
+        return deltas
+
+    def add(self, group):
+        gid = self._new_id()
+        self._do([("add", gid, group)])
+        return gid
+
+    def remove(self, gid):
+        group = self.groups[gid]
+        self._do([("remove", gid, tuple(list(s) for s in group))])
+        return group
+
+    def pop(self):
+        """ remove the last group """
+        if not self.groups:
+            raise IndexError("pop from an empty mapping")
+        return self.remove(self._ids[-1])
+
+    def clear(self):
+        self._do([("remove", gid, tuple(list(s) for s in group))
+                  for gid, group in self.groups.items()])
+
+    def reset(self):
+        """ remove every group, without undo """
+        self.groups.clear()
+        self._ids.clear()
+        for index in self.index:
+            index[:] = array.array("i", [-1]) * len(index)
+        self._undo.clear()
+        self._redo.clear()
+        self._current = self._repr = None
+
+    def delete_word(self, side, word_idx, word):
+        """ delete a word and the group holding it, returns the deltas """
+        deltas = []
+        gid = self.group_of(side, word_idx)
+        if gid >= 0:
+            group = self.groups[gid]
+            deltas.append(("remove", gid, tuple(list(s) for s in group)))
+        deltas.append(("delete_word", side, word_idx, word))
+        return self._do(deltas)
+
+    def _inverse(self, deltas):
+        return [(self.INVERSE[op], *args) for op, *args in reversed(deltas)]
+
+    def undo(self):
+        """ undo the last change, returns the deltas applied, or None """
+        if not self._undo:
+            return None
+        deltas = self._inverse(self._undo.pop())
+        for delta in deltas:
+            self._apply(delta)
+        self._redo.append(deltas)
+        return deltas
+
+    def redo(self):
+        if not self._redo:
+            return None
+        deltas = self._inverse(self._redo.pop())
+        for delta in deltas:
+            self._apply(delta)
+        self._undo.append(deltas)
+        return deltas
 
     def restore(self):
-        self._current = list(self.source)
+        """ undo every change """
+        while self.undo() is not None:
+            pass
+
+
+class Layout:
+    """ Position (row, col) of each word on lines of `width` columns. Words
+    are separated by a space and start a new row rather than being cut,
+    unless longer than a row. """
+    def __init__(self, width):
+        self.width = width
+        self.rows = array.array("i")
+        self.cols = array.array("i")
+        self.end = (0, 0)  # position after the last word
+
+    def _after(self, row, col, word):
+        end = col + len(word)
+        return row + end // self.width, end % self.width
+
+    def update(self, words, from_idx=None, edits=()):
+        """ lay out `words` again: all of them from `from_idx` on if given,
+        and from the first of `edits`, (word idx, 1 if inserted or -1 if
+        deleted). Past the edits, the first word found at its former
+        position, and the words after it, are left in place. Returns
+        (index of the first word laid out, its position, index after the
+        last one). """
+        first = len(words) if from_idx is None else from_idx
+        last = -1  # words up to this one are laid out anyway
+        for idx, step in edits:
+            if step > 0:
+                self.rows.insert(idx, -1)
+                self.cols.insert(idx, -1)
+                last += last >= idx
+            else:
+                del self.rows[idx:idx + 1]
+                del self.cols[idx:idx + 1]
+                last -= last > idx
+            first = min(first, idx)
+            last = max(last, idx)
+        if from_idx is not None:
+            del self.rows[from_idx:]
+            del self.cols[from_idx:]
+        row, col = 0, 0
+        if first:
+            row, col = self._after(self.rows[first - 1],
+                                   self.cols[first - 1], words[first - 1])
+        start = row, col
+        for i in range(first, len(words)):
+            word = words[i]
+            if col:
+                col += 1
+                if col + len(word) > self.width:
+                    row, col = row + 1, 0
+            if i < len(self.rows):
+                if i > last and self.rows[i] == row and self.cols[i] == col:
+                    return first, start, i
+                self.rows[i] = row
+                self.cols[i] = col
+            else:
+                self.rows.append(row)
+                self.cols.append(col)
+            row, col = self._after(row, col, word)
+        self.end = (row, col)
+        return first, start, len(words)
+
+    @property
+    def n_rows(self):
+        return self.end[0] + (self.end[1] > 0)
+
+    def position(self, word_idx):
+        if word_idx < len(self.rows):
+            return self.rows[word_idx], self.cols[word_idx]
+        return self.end
+
+    def word_at(self, row, col):
+        """ index of the last word starting before (row, col) """
+        lo = bisect.bisect_left(self.rows, row)
+        hi = bisect.bisect_right(self.rows, row)
+        idx = bisect.bisect_right(self.cols, col, lo, hi) - 1
+        if idx < lo and lo < hi:
+            idx = lo
+        return min(max(idx, 0), len(self.rows) - 1)
+
+
+class SentenceView:
+    """ A pad showing a sentence as laid out by a `Layout`. Words whose
+    status changed, or that got or lost the cursor, are drawn again at once.
+    Rows where words moved, after a change of the words, are only drawn
+    again once shown. """
+    def __init__(self, sentence, pad):
+        self.sentence = sentence
+        self.pad = pad
+        _, self.width = pad.getmaxyx()
+        self.layout = Layout(self.width)
+        self._drawn_active = None  # (sentence.active, view is active)
+        self._stale = []  # sorted (first row, end row) to be drawn again
+
+    def _draw_word(self, i, color_map, active):
+        sentence = self.sentence
+        if i >= len(sentence.words):
+            return
+        color = color_map[sentence.status(i).name
+                          + "_active" * (i == sentence.active)
+                          + "_waiting" * (not active and i == sentence.active)]
+        self.pad.addstr(self.layout.rows[i], self.layout.cols[i],
+                        sentence.words[i], color)
+
+    def _draw_row(self, row, color_map, active):
+        self.pad.move(row, 0)
+        self.pad.clrtoeol()
+        rows, cols = self.layout.rows, self.layout.cols
+        words = self.sentence.words
+        lo = bisect.bisect_left(rows, row)
+        hi = bisect.bisect_left(rows, row + 1, lo)
+        if lo and rows[lo - 1] + (cols[lo - 1] + len(words[lo - 1]) - 1) \
+                // self.width >= row:  # a long word from the row before
+            lo -= 1
+        for i in range(lo, hi):
+            self._draw_word(i, color_map, active)
+
+    def _mark_stale(self, row_start, row_end):
+        stale = []
+        for start, end in sorted(self._stale + [(row_start, row_end)]):
+            if stale and start <= stale[-1][1]:
+                stale[-1] = (stale[-1][0], max(end, stale[-1][1]))
+            else:
+                stale.append((start, end))
+        self._stale = stale
+
+    def _draw_stale(self, row_start, row_end, color_map, active):
+        """ draw the stale rows among [row_start, row_end) """
+        stale = []
+        for start, end in self._stale:
+            lo, hi = max(start, row_start), min(end, row_end)
+            if lo >= hi:
+                stale.append((start, end))
+                continue
+            for row in range(lo, hi):
+                self._draw_row(row, color_map, active)
+            if start < lo:
+                stale.append((start, lo))
+            if hi < end:
+                stale.append((hi, end))
+        self._stale = stale
+
+    def draw(self, color_map, active, pos_h, display_height):
+        """ draw what changed, and show the rows around the active word at
+        line `pos_h` of the screen """
+        sentence = self.sentence
+        changed, changed_from, edits = sentence.pop_changes()
+        if self._drawn_active is not None:
+            drawn_idx, drawn_view_active = self._drawn_active
+            for idx, step in edits:
+                drawn_idx += ((drawn_idx >= idx) if step > 0
+                              else -(drawn_idx > idx))
+            self._drawn_active = (drawn_idx, drawn_view_active)
+        if changed_from is not None or edits:
+            first, start, stop = self.layout.update(sentence.words,
+                                                    changed_from, edits)
+            height = max(self.layout.n_rows, 1) + 1  # last cell of a pad
+            if height != self.pad.getmaxyx()[0]:     # can not be written
+                self.pad.resize(height, self.width)
+            row_end = (self.layout.rows[stop] + 1
+                       if stop < len(sentence.words) else height)
+            self._mark_stale(start[0], row_end)
+            changed = {i for i in changed if not first <= i < stop}
+        drawn_active = (sentence.active, active)
+        if drawn_active != self._drawn_active:
+            if self._drawn_active is not None:
+                changed.add(self._drawn_active[0])
+            changed.add(sentence.active)
+            self._drawn_active = drawn_active
+        for i in changed:
+            self._draw_word(i, color_map, active)
+
+        pad_height, _ = self.pad.getmaxyx()
+        row_active, _ = self.layout.position(sentence.active)
+        first_row = max(min(row_active - display_height // 2,
+                            pad_height - display_height), 0)
+        self._draw_stale(first_row, min(first_row + display_height,
+                                        pad_height), color_map, active)
+        self.pad.noutrefresh(first_row, 0, pos_h, 0,
+                             pos_h + display_height - 1, self.width - 1)
+
+
+class CursesTerminal:
+    """ What `main` needs from a terminal, here curses. Keys read are
+    written to `record`, if any, one key code per line. """
+    def __init__(self, stdscr, record=None):
+        self.stdscr = stdscr
+        self.record = record
 
     def clear(self):
-        self._current.clear()
+        self.stdscr.clear()
+        self.stdscr.noutrefresh()
 
-    def pop(self, idx=-1):
-        return self._current.pop(idx)
+    def newpad(self, height, width):
+        return curses.newpad(height, width)
 
-    def add(self, value):
-        self._current.append(value)
+    def newwin(self, height, width, y, x):
+        return curses.newwin(height, width, y, x)
 
+    def color_map(self):
+        return get_color_map()
 
-def update_pad(pad, sentence, color_map, active=False):
-    pad.clear()
-    for i, word in enumerate(sentence.words):
-        color = color_map[sentence.words_status[i].name
-                          + "_active" * (i == sentence.active)
-                          + "_waiting" * (not active and i == sentence.active)]
-        pad.addstr(word, color)
-        pad.addstr(" ")
+    def doupdate(self):
+        curses.doupdate()
+
+    def getch(self):
+        c = self.stdscr.getch()
+        if self.record is not None:
+            self.record.write(f"{c}\n")
+            self.record.flush()
+        return c
+
+
+class VirtualWindow:
+    """ In-memory curses window or pad, with the methods `main` uses.
+    Refreshing copies it to the screen of its VirtualTerminal. """
+    def __init__(self, screen, height, width, y=0, x=0):
+        self.screen = screen
+        self.y, self.x = y, x
+        self.cells = []
+        self.cur_y = self.cur_x = 0
+        self.resize(height, width)
+
+    def _blank_row(self):
+        return [(" ", 0)] * self.width
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def resize(self, height, width):
+        self.height, self.width = height, width
+        self.cells = [(row + self._blank_row())[:width]
+                      for row in self.cells[:height]]
+        self.cells.extend(self._blank_row()
+                          for _ in range(height - len(self.cells)))
+        self.cur_y = min(self.cur_y, height - 1)
+        self.cur_x = min(self.cur_x, width - 1)
+
+    def clear(self):
+        self.cells = [self._blank_row() for _ in range(self.height)]
+        self.cur_y = self.cur_x = 0
+
+    def move(self, y, x):
+        self.cur_y, self.cur_x = y, x
+
+    def clrtoeol(self):
+        row = self.cells[self.cur_y]
+        row[self.cur_x:] = [(" ", 0)] * (self.width - self.cur_x)
+
+    def clrtobot(self):
+        self.clrtoeol()
+        for y in range(self.cur_y + 1, self.height):
+            self.cells[y] = self._blank_row()
+
+    def addstr(self, *args):
+        """ addstr([y, x,] str[, attr]) """
+        if isinstance(args[0], str):
+            y, x = self.cur_y, self.cur_x
+        else:
+            y, x, *args = args
+        text, attr = args[0], (args[1] if len(args) > 1 else 0)
+        for char in text:
+            if y >= self.height:
+                raise curses.error("addstr() returned ERR")
+            self.cells[y][x] = (char, attr)
+            x += 1
+            if x == self.width:
+                y, x = y + 1, 0
+        self.cur_y, self.cur_x = y, x
+        if y >= self.height:  # as curses, the cursor can not leave the window
+            raise curses.error("addstr() returned ERR")
+
+    def noutrefresh(self, *args):
+        """ noutrefresh() for a window, noutrefresh(pminrow, pmincol,
+        sminrow, smincol, smaxrow, smaxcol) for a pad """
+        if args:
+            pminrow, pmincol, sminrow, smincol, smaxrow, smaxcol = args
+        else:
+            pminrow, pmincol, sminrow, smincol = 0, 0, self.y, self.x
+            smaxrow = self.y + self.height - 1
+            smaxcol = self.x + self.width - 1
+        for y in range(sminrow, smaxrow + 1):
+            row_idx = pminrow + y - sminrow
+            if row_idx >= self.height or y >= len(self.screen):
+                break
+            row = self.cells[row_idx][pmincol:pmincol + smaxcol - smincol + 1]
+            self.screen[y][smincol:smincol + len(row)] = row
+
+
+class VirtualTerminal:
+    """ Terminal for running `main` without a tty: keys are read from
+    `keys` (key codes, then "q"), and drawn to `screen`, a grid of
+    (char, attr). The time spent on each key, from reading it to reading
+    the next one, is kept in `latencies`. """
+    def __init__(self, keys, height=50, width=80):
+        self.keys = iter(keys)
+        self.width = width
+        self.screen = [[(" ", 0)] * width for _ in range(height)]
+        self.latencies = []  # (key, seconds)
+        self.startup = None  # seconds until the first key is read
+        self._key = None
+        self._time = None
 
+    def clear(self):
+        for row in self.screen:
+            row[:] = [(" ", 0)] * self.width
+        self._time = time.perf_counter()
+
+    def newpad(self, height, width):
+        return VirtualWindow(self.screen, height, width)
+
+    def newwin(self, height, width, y, x):
+        return VirtualWindow(self.screen, height, width, y, x)
+
+    def color_map(self):
+        return collections.defaultdict(itertools.count(1).__next__)
 
-def refresh_pad(pad, start_line, n_lines, pos_h, width):
-    pad.noutrefresh(start_line, 0, pos_h, 0, pos_h + n_lines-1, width)
+    def doupdate(self):
+        pass
+
+    def getch(self):
+        now = time.perf_counter()
+        if self._key is None:
+            self.startup = now - self._time
+        else:
+            self.latencies.append((self._key, now - self._time))
+        self._key = next(self.keys, ord("q"))
+        self._time = time.perf_counter()
+        return self._key
+
+    def lines(self):
+        return ["".join(char for char, _ in row).rstrip()
+                for row in self.screen]
+
+    def report(self):
+        """ number of keys, total time and latency percentiles, in seconds """
+        latencies = sorted(latency for _, latency in self.latencies)
+        report = {"keys": len(latencies), "total": sum(latencies),
+                  "startup": self.startup}
+        for name, q in (("p50", .5), ("p90", .9), ("p99", .99), ("max", 1)):
+            report[name] = (latencies[min(int(q * len(latencies)),
+                                          len(latencies) - 1)]
+                            if latencies else None)
+        return report
+
+
+def read_keys(path):
+    """ key codes of a session recorded by CursesTerminal """
+    with open(path) as f:
+        return [int(line) for line in f if line.strip()]
+
+
+def keys_from_str(s):
+    return [ord(c) for c in s]
 
 
 def update_corresp(sent_idx, sentences, mapping):
-    def find_corresp(sent_idx, word_idx, mapping):
-        for i, corresp in enumerate(mapping.current):
-            if word_idx in corresp[sent_idx]:
-                return i, corresp
-        raise ValueError(f"Did not find corresp containing {word_idx}")
-
-    try:
-        sentence = sentences[sent_idx]
-        i, corresp = find_corresp(sent_idx, sentence.active, mapping)
+    gid = mapping.group_of(sent_idx, sentences[sent_idx].active)
+    if gid >= 0:
+        corresp = mapping.remove(gid)
         for sentence, selection in zip(sentences, corresp):
             sentence.clear_selection()
             sentence.unfix(*selection)
-        mapping.pop(i)
-    except ValueError:
-        pass
 
 
-def main(stdscr, sentences, mapping):
-    stdscr.clear()
-    stdscr.noutrefresh()
+def main(term, sentences, mapping):
+    """ `term` is a CursesTerminal or a VirtualTerminal """
+    term.clear()
 
     max_display_height = 11
     s_idx = 0
     width = 80
-    pads_sent = []
-    heights = []
-    for sentence in sentences:
-        heights.append(sentence.char_len // width + 1)
-        pads_sent.append(curses.newpad(heights[-1], width))
-    display_heights = [min(h, max_display_height) for h in heights]
+    views = [SentenceView(sentence, term.newpad(1, width))
+             for sentence in sentences]
+    display_heights = []
+    for view in views:
+        view.layout.update(view.sentence.words, 0)
+        display_heights.append(min(max(view.layout.n_rows, 1),
+                                   max_display_height))
     line_select = sum(display_heights) + 2
-    win_select = curses.newwin(2, width, line_select, 0)
+    win_select = term.newwin(2, width, line_select, 0)
     line_map = line_select + len(sentences)
-    win_map = curses.newwin(1, width, line_map, 0)
+    win_map = term.newwin(1, width, line_map, 0)
     line_mode = line_map + 2
-    win_mode = curses.newwin(1, width, line_mode, 0)
+    win_mode = term.newwin(1, width, line_mode, 0)
 
     def prune(s, width_=width):
         return "..." * (len(s) > width_) + s[-width_ + 4:]
@@ -281,21 +854,17 @@ def main(stdscr, sentences, mapping):
     def mode_str(cont_sel, width_=width):
         return prune("CONTINUOUS SELECTION" if cont_sel else "", width_)
 
-    color_map = get_color_map()
-    cursor = 0  # char idx, for better moving
+    color_map = term.color_map()
+    cursor = 0  # column, for better moving
     continuous_selection = False
 
     while True:
         # draw
-        for i, (sentence, pad, display_height) \
-                in enumerate(zip(sentences, pads_sent, display_heights)):
-            update_pad(pad, sentence, color_map=color_map, active=(s_idx == i))
-            pad_height, _ = pad.getmaxyx()
-            nrow_active = sentence.char_at_word(sentence.active) // width
-            first_row = min(max(nrow_active - display_height // 2, 0),
-                            pad_height - display_height)
-            pos_h = i * (display_height+1)
-            pad.noutrefresh(first_row, 0, pos_h, 0, pos_h + display_height - 1, width)
+        pos_h = 0
+        for i, (view, display_height) \
+                in enumerate(zip(views, display_heights)):
+            view.draw(color_map, s_idx == i, pos_h, display_height)
+            pos_h += display_height + 1
 
         win_select.clear()
         win_select.addstr(0, 0, "0: " +
@@ -304,7 +873,7 @@ def main(stdscr, sentences, mapping):
                           prune(" ".join(sentences[1].selected_words), width - 3))
         win_select.noutrefresh()
 
-        map_cur = repr(mapping.current)
+        map_cur = mapping.repr_tail(width)
         win_map.clear()
         win_map.addstr(0, 0, prune(map_cur))
         win_map.noutrefresh()
@@ -313,23 +882,12 @@ def main(stdscr, sentences, mapping):
         win_mode.addstr(0, 0, mode_str(continuous_selection), color_map["mode"])
         win_mode.noutrefresh()
 
-        def down(cursor, width, n_chars):
-            next_cursor = cursor + width
-            if next_cursor < n_chars:
-                return next_cursor
-            return cursor
-
-        def up(cursor, width):
-            next_cursor = cursor - width
-            if next_cursor >= 0:
-                return next_cursor
-            return cursor
-
-        curses.doupdate()
+        term.doupdate()
 
         # input
         sentence = sentences[s_idx]
-        c = stdscr.getch()
+        layout = views[s_idx].layout
+        c = term.getch()
 
         ## leaving
         if c in (ord("q"), ord("Q")):
@@ -338,26 +896,31 @@ def main(stdscr, sentences, mapping):
         ## moving
         if c in (ord("l"), curses.KEY_RIGHT):
             sentence.activate(sentence.next_nofixed())
-            cursor = sentence.char_at_word(sentence.active)
+            _, cursor = layout.position(sentence.active)
         if c in (ord("h"), curses.KEY_LEFT):
             sentence.activate(sentence.prev_nofixed())
-            cursor = sentence.char_at_word(sentence.active)
+            _, cursor = layout.position(sentence.active)
         if c in (ord("L"), ):
             sentence.activate(sentence.next())
-            cursor = sentence.char_at_word(sentence.active)
+            _, cursor = layout.position(sentence.active)
         if c in (ord("H"), ):
             sentence.activate(sentence.prev())
-            cursor = sentence.char_at_word(sentence.active)
+            _, cursor = layout.position(sentence.active)
         if c in (ord("j"), ):
-            cursor = down(cursor, width, sentence.char_len)
-            sentence.activate(sentence.word_at_char(cursor))
+            row, _ = layout.position(sentence.active)
+            idx = sentence.active
+            while idx == sentence.active and row + 1 < layout.n_rows:
+                row += 1  # rows of a long word are skipped
+                idx = layout.word_at(row, cursor)
+            sentence.activate(idx)
         if c in (ord("k"), ):
-            cursor = up(cursor, width)
-            sentence.activate(sentence.word_at_char(cursor))
+            row, _ = layout.position(sentence.active)
+            if row > 0:
+                sentence.activate(layout.word_at(row - 1, cursor))
         if c in (ord("\t"), ):
             s_idx = (s_idx + 1) % len(sentences)
             sentence = sentences[s_idx]
-            cursor = sentence.char_at_word(sentence.active)
+            _, cursor = views[s_idx].layout.position(sentence.active)
         if c in (ord("K"), ord("J")):
             char_idx = sentence.char_at_word(sentence.active)
             s_idx = (s_idx + 1) % len(sentences)
@@ -386,7 +949,7 @@ def main(stdscr, sentences, mapping):
                     sentence.unfix(*selection)
             except IndexError:
                 pass
-        if c in (ord("x"), ):
+        if c in (ord("x"), ) and len(sentence.words) > 1:
             idx = sentence.closest_nofixed(sentence.active)
             delete_word(s_idx, sentence.active, sentences, mapping)
             sentence.activate(min(idx, len(sentence.words) - 1))
@@ -398,6 +961,13 @@ def main(stdscr, sentences, mapping):
         if continuous_selection and c in (ord("h"), ord("l")):
             sentence.add_to_selection(sentence.active)
 
+        ## undoing
+        if c in (ord("u"), ord("U")):
+            undo(sentences, mapping, redo=(c == ord("U")))
+            for sentence in sentences:
+                sentence.activate(min(sentence.active,
+                                      len(sentence.words) - 1))
+
         ## ESCAPE
         if c == 27:
             continuous_selection = False
@@ -407,22 +977,40 @@ def main(stdscr, sentences, mapping):
             changed = sentence.split()
             if changed:
                 for sentence in sentences:
-                    sentence.words_status = [Status.normal for _ in sentence.words]
-                mapping.clear()
-
-
-def process_manually(tokens0, tokens1, map_):
-    sentences = [
-        Sentence(tokens0),
-        Sentence(tokens1)
-    ]
-    for corresp in map_:
-        for selection, sentence in zip(corresp, sentences):
-            sentence.add_to_selection(*selection)
-            sentence.fix_selection()
-    mapping = Mapping(map_)
-
-    os.environ.setdefault('ESCDELAY', '25')  # reduce escape delay to use as any other key
-    curses.wrapper(lambda stdscr: main(stdscr, sentences, mapping))
+                    sentence.clear_statuses()
+                mapping.reset()
+
+
+def statuses_from_index(index, n_words):
+    groups = itertools.chain(index, itertools.repeat(-1))
+    return [Status.fixed if igroup >= 0 else Status.normal
+            for igroup in itertools.islice(groups, n_words)]
+
+
+def process_manually(tokens0, tokens1, map_, terminal=None, record=None):
+    """ `map_` is a data.Alignment, or a list of correspondences. Runs in
+    curses, recording keys to the file `record` if given, unless a
+    VirtualTerminal is given as `terminal`. """
+    if hasattr(map_, "group_of"):
+        sentences = [Sentence(tokens, statuses_from_index(index, len(tokens)))
+                     for tokens, index in zip((tokens0, tokens1), map_.index)]
+    else:
+        sentences = [
+            Sentence(tokens0),
+            Sentence(tokens1)
+        ]
+        for corresp in map_:
+            for selection, sentence in zip(corresp, sentences):
+                sentence.add_to_selection(*selection)
+                sentence.fix_selection()
+    mapping = Mapping(map_, (len(tokens0), len(tokens1)))
+
+    if terminal is not None:
+        main(terminal, sentences, mapping)
+    else:
+        os.environ.setdefault('ESCDELAY', '25')  # reduce escape delay to use as any other key
+        curses.wrapper(
+            lambda stdscr: main(CursesTerminal(stdscr, record), sentences,
+                                mapping))
 
     return sentences[0].words, sentences[1].words, mapping.current
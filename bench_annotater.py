@@ -0,0 +1,60 @@
+""" Replay keystroke sessions on the annotater, headless, on synthetic texts
+of increasing size, and report the time spent per key: navigation,
+selection, delete_word (with undo/redo) and the redraw after each key. """
+import argparse
+import curses
+import random
+
+import annotater
+
+
+def synthetic(n_words, seed=0):
+    """ two texts of `n_words` words, every third word of the first one
+    aligned with the same word of the second """
+    rng = random.Random(seed)
+    vocab = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz")
+                     for _ in range(rng.randint(1, 10))) for _ in range(1000)]
+    tokens0 = [rng.choice(vocab) for _ in range(n_words)]
+    tokens1 = [rng.choice(vocab) for _ in range(n_words)]
+    map_ = [([i], [i]) for i in range(0, n_words, 3)]
+    return tokens0, tokens1, map_
+
+
+keys = annotater.keys_from_str
+SESSIONS = {
+    "navigation": keys("l" * 200 + "h" * 100 + "j" * 30 + "k" * 30
+                       + "L" * 50 + "H" * 50 + "\t" + "l" * 100 + "J"),
+    "selection": (keys("slsl\tsl\n\t") * 30
+                  + [curses.KEY_BACKSPACE] * 10 + keys("vllll\x1bc") * 10),
+    "delete_word": keys("lx" * 50 + "u" * 20 + "U" * 10),
+}
+
+
+def replay(tokens0, tokens1, map_, keys):
+    terminal = annotater.VirtualTerminal(keys)
+    annotater.process_manually(list(tokens0), list(tokens1), list(map_),
+                               terminal=terminal)
+    return terminal.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000], help="words per text")
+    parser.add_argument("--keys", default=None,
+                        help="replay this recorded session (see annotate.py "
+                        "--record) instead of the synthetic ones")
+    args = parser.parse_args()
+
+    sessions = (SESSIONS if args.keys is None
+                else {args.keys: annotater.read_keys(args.keys)})
+    print(f"{'words':>7} {'session':<12} {'keys':>5} {'startup':>9} "
+          f"{'total':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}  (ms)")
+    for size in args.sizes:
+        texts = synthetic(size)
+        for name, session in sessions.items():
+            report = replay(*texts, session)
+            print(f"{size:>7} {name:<12} {report['keys']:>5} "
+                  + " ".join(f"{1000 * report[k]:>9.3f}"
+                             for k in ("startup", "total", "p50", "p90", "p99",
+                                       "max")))
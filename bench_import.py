@@ -0,0 +1,46 @@
+""" Import time of modules, each in a fresh interpreter: median of several
+runs, and whether pymongo was imported along the way. """
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+CODE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, "pymongo" in sys.modules)
+"""
+
+
+def import_time(module, env=None):
+    """ (seconds, whether pymongo was imported) """
+    result = subprocess.run(
+        [sys.executable, "-c", CODE.format(module=module)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        capture_output=True, text=True, check=True)
+    elapsed, pymongo = result.stdout.split()
+    return float(elapsed), pymongo == "True"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modules", nargs="+",
+                        default=["data", "annotate", "reader", "main"])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--dao", default=None,
+                        help="LANG_DAO url to import with, see "
+                        "data.dao_from_url")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.dao is not None:
+        env["LANG_DAO"] = args.dao
+    print(f"{'module':<10} {'median':>9} {'min':>9}  pymongo  (ms)")
+    for module in args.modules:
+        runs = [import_time(module, env) for _ in range(args.repeat)]
+        times = [elapsed for elapsed, _ in runs]
+        print(f"{module:<10} {1000 * statistics.median(times):>9.1f} "
+              f"{1000 * min(times):>9.1f}  {runs[0][1]}")
@@ -0,0 +1,96 @@
+""" Round-trip time, encoded size and memory per entry of data.Entry on large
+synthetic entries, for each codec. "load" decodes a document and every
+section of the entry, "save" encodes it back without changes, "edit" after
+changing the tokens and map of a target language. """
+import argparse
+import gc
+import time
+import tracemalloc
+
+import bench_tokenize
+import codec
+import data
+import tokenizer
+
+
+def synthetic(n_words, langs=("fr", "de", "es"), seed=0):
+    """ an entry with `langs` as targets, every other token of the source
+    aligned with the same token of each target """
+    text_src = data.Text("en", bench_tokenize.words_text(n_words, seed))
+    text_src.set_tokens(tokenizer.tokenize_manually(text_src.str))
+    entry = data.Entry(text_src)
+    for i, lang in enumerate(langs):
+        text = data.Text(lang,
+                         bench_tokenize.words_text(n_words, seed + i + 1))
+        text.set_tokens(tokenizer.tokenize_manually(text.str))
+        n = min(text_src.n_tokens, text.n_tokens)
+        entry.add(text, [([j], [j]) for j in range(0, n, 2)])
+    return entry
+
+
+def load(doc_codec, payload):
+    entry = data.Entry.from_dict(doc_codec.loads(payload))
+    for lang in entry.langs:
+        entry.get_text(lang).token_ids
+    return entry
+
+
+def edit(entry):
+    lang = entry.target_langs[0]
+    text, map_ = entry.get(lang)
+    text.set_tokens(text.tokens[1:] + text.tokens[:1])
+    entry.set(lang, map_=list(map_)[1:])
+    return entry
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def memory(function, n):
+    """ bytes allocated per object by `n` calls to `function` """
+    gc.collect()
+    tracemalloc.start()
+    objects = [function() for _ in range(n)]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return size // n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000],
+                        help="words per text")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--codecs", nargs="+", default=None,
+                        help=f"among {', '.join(codec.CODECS)}, by default "
+                        "the available ones")
+    args = parser.parse_args()
+
+    names = args.codecs or [name for name in codec.CODECS
+                            if name != "msgpack" or codec.msgpack is not None]
+    codecs = [codec.get_codec(name) for name in names]
+    print(f"{'words':>7} {'codec':<8} {'bytes':>10} {'load':>9} {'save':>9} "
+          f"{'edit':>9} {'memory':>10}  (ms, bytes per entry)")
+    for size in args.sizes:
+        payload_entry = synthetic(size)
+        for doc_codec in codecs:
+            payload = doc_codec.dumps(payload_entry.to_dict())
+            entry, t_load = timed(lambda: load(doc_codec, payload),
+                                  args.repeat)
+            _, t_save = timed(lambda: doc_codec.dumps(entry.to_dict()),
+                              args.repeat)
+            _, t_edit = timed(
+                lambda: doc_codec.dumps(edit(entry).to_dict()), args.repeat)
+            mem = memory(lambda: load(doc_codec, payload),
+                         max(1, 100000 // size))
+            print(f"{size:>7} {doc_codec.name:<8} {len(payload):>10} "
+                  + " ".join(f"{1000 * t:>9.3f}"
+                             for t in (t_load, t_save, t_edit))
+                  + f" {mem:>10}")
@@ -0,0 +1,76 @@
+""" Time tokenizer.tokenize_manually/detokenize_* against the former
+char-by-char implementations, in chars/s. tests/test_tokenizer.py checks
+that their outputs are identical. """
+import argparse
+import random
+import time
+
+import tokenizer
+
+
+def tokenize_manually_chars(s):
+    tokens = []
+    in_word = False
+    for i, c in enumerate(s):
+        if c in tokenizer.MANUAL_MAP:
+            if in_word:
+                tokens.append(s[start_word:i])
+                in_word = False
+            tokens.append(tokenizer.MANUAL_MAP[c])
+        else:
+            if not in_word:
+                in_word = True
+                start_word = i
+    if in_word:
+        tokens.append(s[start_word:])
+    return tokens
+
+
+def detokenize_lookup(tokens, table):
+    def process(token):
+        return table[token] if token in table else token
+    return "".join(map(process, tokens))
+
+
+def words_text(n_words, seed=0):
+    rng = random.Random(seed)
+    words = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyzéà")
+                     for _ in range(rng.randint(1, 10))) for _ in range(1000)]
+    return "".join(rng.choice(words) + rng.choice("    _\n")
+                   for _ in range(n_words))
+
+
+def bench(name, function, items, n_chars):
+    start = time.perf_counter()
+    function(items)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {elapsed:8.3f} s {n_chars / elapsed / 1e6:8.2f} Mchars/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=500,
+                        help="words per text")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="worker processes for the pool run (0: one per "
+                        "cpu)")
+    args = parser.parse_args()
+
+    texts = [words_text(args.words, seed) for seed in range(args.texts)]
+    n_chars = sum(map(len, texts))
+    token_lists = [tokenize_manually_chars(text) for text in texts]
+    print(f"{args.texts} texts, {n_chars} chars")
+    bench("tokenize (chars)", lambda xs: list(map(tokenize_manually_chars, xs)),
+          texts, n_chars)
+    bench("tokenize_many", tokenizer.tokenize_many, texts, n_chars)
+    bench("tokenize_many (pool)",
+          lambda xs: tokenizer.tokenize_many(xs, processes=args.processes),
+          texts, n_chars)
+    bench("detokenize_human (lookup)",
+          lambda xs: [detokenize_lookup(x, tokenizer.TOKEN_HUMAN) for x in xs],
+          token_lists, n_chars)
+    bench("detokenize_many", tokenizer.detokenize_many, token_lists, n_chars)
+    bench("detokenize_many (pool)",
+          lambda xs: tokenizer.detokenize_many(xs, processes=args.processes),
+          token_lists, n_chars)
@@ -0,0 +1,206 @@
+import collections
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+
+class LRUCache:
+    """ In-process cache of rendered bodies (str or bytes), bounded both in
+    number of items and in total size. Keys are tuples whose first element
+    is the entry id, so that all keys of an entry can be invalidated.
+    `size(value)` is the size counted against `max_bytes`, the length of
+    the body by default. """
+    def __init__(self, max_items=256, max_bytes=64 * 2**20, size=len):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.size = size
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = collections.OrderedDict()
+        self._keys_by_id = collections.defaultdict(set)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, _ = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._items[key] = (value, size)
+            self._keys_by_id[key[0]].add(key)
+            self.n_bytes += size
+            while (len(self._items) > self.max_items
+                   or self.n_bytes > self.max_bytes):
+                self._discard(next(iter(self._items)))
+                self.evictions += 1
+
+    def _discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.n_bytes -= item[1]
+            keys = self._keys_by_id[key[0]]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_id[key[0]]
+
+    def invalidate(self, id_):
+        with self._lock:
+            for key in list(self._keys_by_id.get(id_, ())):
+                self._discard(key)
+
+    def stats(self):
+        return {"items": len(self._items), "bytes": self.n_bytes,
+                "max_items": self.max_items, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+
+class DiskCache:
+    """ Cache shared by several processes: one directory per entry id, one
+    file per key. Files are written atomically. Bounded in total size and
+    number of files: past either, the least recently used files (by mtime,
+    refreshed on hits) are removed down to `low_water` of the bounds. The
+    usage of other processes is only seen when evicting, by a scan. """
+    def __init__(self, path, max_bytes=2**30, max_files=100000,
+                 low_water=0.9):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.low_water = low_water
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        files = list(self._files())
+        self.n_bytes = sum(size for _, size, _ in files)
+        self.n_files = len(files)
+
+    @staticmethod
+    def _hash(value):
+        return hashlib.sha1(repr(value).encode()).hexdigest()
+
+    def _dir(self, id_):
+        return os.path.join(self.path, self._hash(id_))
+
+    def _file(self, key):
+        return os.path.join(self._dir(key[0]), self._hash(key[1:]))
+
+    def _files(self):
+        """ yield (mtime, size, path) of the cached files """
+        for dir_ in os.scandir(self.path):
+            if not dir_.is_dir():
+                continue
+            for file in os.scandir(dir_.path):
+                if file.name.startswith("."):  # being written
+                    continue
+                try:
+                    stat = file.stat()
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, file.path
+
+    def get(self, key):
+        path = self._file(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        dir_ = self._dir(key[0])
+        os.makedirs(dir_, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dir_, prefix=".")
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        os.replace(tmp_path, self._file(key))
+        with self._lock:
+            self.n_bytes += len(value)
+            self.n_files += 1
+            if self.n_bytes > self.max_bytes or self.n_files > self.max_files:
+                self._evict()
+
+    def _evict(self):
+        files = sorted(self._files())
+        n_bytes = sum(size for _, size, _ in files)
+        n_files = len(files)
+        for _, size, path in files:
+            if (n_bytes <= self.low_water * self.max_bytes
+                    and n_files <= self.low_water * self.max_files):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            n_bytes -= size
+            n_files -= 1
+            self.evictions += 1
+        self.n_bytes, self.n_files = n_bytes, n_files
+
+    def invalidate(self, id_):
+        dir_ = self._dir(id_)
+        try:
+            sizes = [file.stat().st_size for file in os.scandir(dir_)]
+        except FileNotFoundError:
+            return
+        shutil.rmtree(dir_, ignore_errors=True)
+        with self._lock:
+            self.n_bytes = max(self.n_bytes - sum(sizes), 0)
+            self.n_files = max(self.n_files - len(sizes), 0)
+
+    def stats(self):
+        return {"path": self.path, "bytes": self.n_bytes,
+                "files": self.n_files, "max_bytes": self.max_bytes,
+                "max_files": self.max_files, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+class RenderCache:
+    """ LRU in memory, backed by an optional DiskCache. Values are bytes. """
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def invalidate(self, id_):
+        self.memory.invalidate(id_)
+        if self.disk is not None:
+            self.disk.invalidate(id_)
+
+    def stats(self):
+        return {"memory": self.memory.stats(),
+                "disk": self.disk.stats() if self.disk is not None else None}
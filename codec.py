@@ -0,0 +1,72 @@
+""" Encoding of entry documents (Entry.to_dict) to bytes, for the DAOs
+storing documents themselves: JSON, or msgpack if installed. JSON goes
+through orjson when it is installed. """
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonCodec:
+    name = "json"
+
+    @staticmethod
+    def dumps(doc):
+        if orjson is not None:
+            return orjson.dumps(doc)
+        return json.dumps(doc, separators=(",", ":")).encode()
+
+    @staticmethod
+    def loads(payload):
+        if orjson is not None:
+            return orjson.loads(payload)
+        return json.loads(payload)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    @staticmethod
+    def dumps(doc):
+        return msgpack.packb(doc, use_bin_type=True)
+
+    @staticmethod
+    def loads(payload):
+        return msgpack.unpackb(payload, raw=False)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, MsgpackCodec)}
+EXTENSIONS = {".json": "json", ".msgpack": "msgpack", ".mpk": "msgpack"}
+
+
+def get_codec(name):
+    try:
+        codec = CODECS[name]
+    except KeyError:
+        raise ValueError(f"unknown codec {name!r}, one of {', '.join(CODECS)}")
+    if codec is MsgpackCodec and msgpack is None:
+        raise ValueError("the msgpack codec needs the msgpack package")
+    return codec
+
+
+def codec_for_path(path):
+    """ codec given by the extension of `path`, json by default """
+    for extension, name in EXTENSIONS.items():
+        if path.endswith(extension):
+            return get_codec(name)
+    return JsonCodec
+
+
+def loads(payload):
+    """ decode a document of either codec: a JSON document starts with "{"
+    (possibly after whitespace), which never starts a msgpack map """
+    if payload.lstrip()[:1] == b"{":
+        return JsonCodec.loads(payload)
+    return get_codec("msgpack").loads(payload)
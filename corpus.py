@@ -0,0 +1,273 @@
+""" Read-only binary corpus: exported once from any EntryDAO, then served
+through `MappedDAO`, which mmaps the file. Several processes reading the
+same file share its pages.
+
+Layout (little-endian):
+    header
+    entries: for each entry
+        info length (u32), info (json)
+        number of sections (u16), then for each: key (string id, u32),
+            section offset (u64). Keys are "src" and the target languages.
+    sections: for each
+        text length (u32), text (utf-8)
+        number of tokens (u32), token string ids (u32 each)
+        number of segments (u32), segment starts (u32 each)
+        map flag (u8), and if set:
+            length (u32) and group of each token (i32 each), for both sides
+            groups as data.pack_groups, for both sides: number of members
+                (u32), members (u32 each), number of bounds (u32), bounds
+                (u32 each)
+    strings: offsets (u64, one more than strings), utf-8 data
+    index: for each entry, by id order: id (string id, u32), offset (u64)
+"""
+import argparse
+import json
+import mmap
+import struct
+
+import data
+
+MAGIC = b"LANGCRP1"
+HEADER = struct.Struct("<8sIIIQQ")  # magic, version, n_entries, n_strings,
+                                    # strings offset, index offset
+VERSION = 2
+U16 = struct.Struct("<H")
+U32 = struct.Struct("<I")
+SECTION_REF = struct.Struct("<IQ")
+INDEX_ITEM = struct.Struct("<IQ")
+
+
+class ReadOnlyError(Exception):
+    pass
+
+
+class _Strings:
+    """ string interning while exporting """
+    def __init__(self):
+        self.ids = {}
+
+    def __call__(self, s):
+        return self.ids.setdefault(s, len(self.ids))
+
+
+def _pack_u32s(values, fmt="I"):
+    return U32.pack(len(values)) + struct.pack(f"<{len(values)}{fmt}", *values)
+
+
+def _pack_section(d, strings):
+    text = d["text"].encode()
+    parts = [U32.pack(len(text)), text,
+             _pack_u32s([strings(token) for token in data.section_tokens(d)]),
+             _pack_u32s(d["segments"])]
+    if "map" in d:
+        parts.append(b"\x01")
+        parts.extend(_pack_u32s(idx, "i") for idx in d["map_index"])
+        groups = d["map"]
+        packed = (groups if isinstance(groups, dict)
+                  else data.pack_groups(groups))
+        for members, bounds in zip(packed["members"], packed["bounds"]):
+            parts.extend((_pack_u32s(members), _pack_u32s(bounds)))
+    else:
+        parts.append(b"\x00")
+    return b"".join(parts)
+
+
+def export(dao, path):
+    """ write every entry of `dao` to a corpus file at `path` """
+    strings = _Strings()
+    index = []
+    with open(path, "wb") as f:
+        f.write(b"\x00" * HEADER.size)
+        for id_ in data.iter_ids(dao):
+            doc = dao.get_entry(id_).to_dict()
+            index.append((strings(str(id_)), f.tell()))
+            info = json.dumps(doc.pop("info")).encode()
+            sections = [(key, _pack_section(d, strings))
+                        for key, d in doc.items()]
+            f.write(U32.pack(len(info)) + info + U16.pack(len(sections)))
+            offset = f.tell() + SECTION_REF.size * len(sections)
+            for key, section in sections:
+                f.write(SECTION_REF.pack(strings(key), offset))
+                offset += len(section)
+            for _, section in sections:
+                f.write(section)
+
+        strings_offset = f.tell()
+        encoded = [s.encode() for s in strings.ids]
+        offsets = [0]
+        for s in encoded:
+            offsets.append(offsets[-1] + len(s))
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        f.write(b"".join(encoded))
+
+        index_offset = f.tell()
+        for id_, offset in index:
+            f.write(INDEX_ITEM.pack(id_, offset))
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(index), len(strings.ids),
+                            strings_offset, index_offset))
+    return len(index)
+
+
+class _Vocabulary(data.Vocabulary):
+    """ the string table of a corpus file, whose string ids are the token
+    ids of all its texts. Only decoded with: a text whose tokens are set
+    gets a Vocabulary of its own. """
+    __slots__ = ()
+
+    def __init__(self, strings):
+        self.ids = None
+        self.tokens = strings
+
+
+class _StringTable:
+    """ the strings of a corpus file, decoded once on first use """
+    def __init__(self, mm, offset, n_strings):
+        offsets_size = 8 * (n_strings + 1)
+        self.mm = mm
+        self._offsets = memoryview(mm)[offset:offset + offsets_size].cast("Q")
+        self._data = offset + offsets_size
+        self._strings = [None] * n_strings
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __getitem__(self, i):
+        s = self._strings[i]
+        if s is None:
+            start = self._data + self._offsets[i]
+            end = self._data + self._offsets[i + 1]
+            s = self._strings[i] = str(self.mm[start:end], "utf-8")
+        return s
+
+
+class MappedDAO(data.EntryDAO):
+    """ Read-only EntryDAO over a corpus file. The token ids, segments and
+    alignment arrays of the texts are memoryviews on the mapped file, and
+    their vocabulary is the string table of the file: strings are decoded
+    once, on first use. """
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+        (magic, version, n_entries, n_strings, strings_offset,
+         index_offset) = HEADER.unpack_from(self.mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a corpus file (version {VERSION})")
+        self.strings = _StringTable(self.mm, strings_offset, n_strings)
+        self.vocab = _Vocabulary(self.strings)
+        self.offsets = {}
+        for i in range(n_entries):
+            id_, offset = INDEX_ITEM.unpack_from(
+                self.mm, index_offset + i * INDEX_ITEM.size)
+            self.offsets[self.strings[id_]] = offset
+        self._sorted_ids = sorted(self.offsets, key=data.id_sort_key)
+
+    def _u32s(self, offset, fmt="I"):
+        n, = U32.unpack_from(self.mm, offset)
+        start = offset + 4
+        return self.view[start:start + 4 * n].cast(fmt), start + 4 * n
+
+    def _entry_header(self, id_):
+        try:
+            offset = self.offsets[id_]
+        except KeyError:
+            raise data.EntryNotFoundError()
+        info_len, = U32.unpack_from(self.mm, offset)
+        info = json.loads(self.mm[offset + 4:offset + 4 + info_len])
+        offset += 4 + info_len
+        n_sections, = U16.unpack_from(self.mm, offset)
+        offset += U16.size
+        sections = {}
+        for i in range(n_sections):
+            key, section_offset = SECTION_REF.unpack_from(
+                self.mm, offset + i * SECTION_REF.size)
+            sections[self.strings[key]] = section_offset
+        return info, sections
+
+    def _text(self, offset, max_chars=None):
+        text_len, = U32.unpack_from(self.mm, offset)
+        end = offset + 4 + text_len
+        if max_chars is not None:  # may cut a character, dropped
+            raw = self.mm[offset + 4:min(end, offset + 4 + 4 * max_chars)]
+            return str(raw, "utf-8", "ignore")[:max_chars], end
+        return str(self.mm[offset + 4:end], "utf-8"), end
+
+    def _section(self, lang, offset):
+        """ (Text, Alignment or None) of the section at `offset`, without
+        copying its arrays """
+        str_, offset = self._text(offset)
+        token_ids, offset = self._u32s(offset)
+        segments, offset = self._u32s(offset)
+        text = data.Text(lang, str_, token_ids, segments, self.vocab)
+        if not self.mm[offset]:
+            return text, None
+        offset += 1
+        index_src, offset = self._u32s(offset, "i")
+        index_tgt, offset = self._u32s(offset, "i")
+        packed = {"members": [], "bounds": []}
+        for _ in range(2):
+            members, offset = self._u32s(offset)
+            bounds, offset = self._u32s(offset)
+            packed["members"].append(members)
+            packed["bounds"].append(bounds)
+        return text, data.Alignment.from_dict(
+            {"map": packed, "map_index": (index_src, index_tgt)})
+
+    def get_entry(self, id_, langs=None):
+        info, sections = self._entry_header(id_)
+        text_src, _ = self._section(info["src"], sections["src"])
+        entry = data.Entry(text_src)
+        for key, offset in sections.items():
+            if key != "src" and (langs is None or key in langs):
+                entry.add(*self._section(key, offset))
+        entry.partial = langs is not None
+        entry.revision = info.get("rev", 0)
+        entry.mtime = info.get("mtime")
+        entry.import_hash = info.get("hash")
+        return entry
+
+    def get_info(self, id_):
+        info, _ = self._entry_header(id_)
+        return info
+
+    def list_summaries(self, limit=20, after=None, before=None):
+        page_ids = data.fetch_page_ids(self._sorted_ids, limit, after, before)
+        return data.Page.from_fetched(self.get_summaries(page_ids), limit,
+                                      after, before)
+
+    def get_summaries(self, ids):
+        summaries = []
+        for id_ in ids:
+            info, sections = self._entry_header(id_)
+            beginning, _ = self._text(sections["src"], data.SUMMARY_SIZE + 1)
+            langs = [info["src"]] + [key for key in sections if key != "src"]
+            summaries.append(data.EntrySummary(id_, info["src"], beginning,
+                                               langs))
+        return summaries
+
+    def write_entry(self, id_, entry, touch=True):
+        raise ReadOnlyError(self.path)
+
+    def add_entry(self, entry):
+        raise ReadOnlyError(self.path)
+
+    def delete_entry(self, id_):
+        raise ReadOnlyError(self.path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="export entries to a corpus file for MappedDAO")
+    parser.add_argument("path")
+    parser.add_argument("--json", default=None,
+                        help="export from this json data file instead of "
+                        "the default DAO")
+    args = parser.parse_args()
+
+    dao = data.DAO if args.json is None else data.JsonDAO(args.json)
+    n_entries = export(dao, args.path)
+    print(f"Exported {n_entries} entries to {args.path}")
@@ -1,70 +1,574 @@
+import array
+import base64
+import bisect
+import collections
+import functools
+import hashlib
+import heapq
+import itertools
 import json
 import os
-import pymongo
+import sys
+import threading
+import time
+import unicodedata
+import urllib.parse
+
+import codec
+import tokenizer
 
 
 data_folder_path = os.path.join(os.path.dirname(__file__), "data")
 default_data_path = os.path.join(data_folder_path, "data.json")
 
 
+SUMMARY_SIZE = 32
+FIND_SCAN_SIZE = 500  # summaries listed at once to index language pairs
+
+DEFAULT_DAO_URL = "mongodb://localhost:27017/lang_db"
+# client options, unless given by the url
+MONGO_OPTIONS = {
+    "maxPoolSize": 16,
+    "minPoolSize": 0,
+    "maxIdleTimeMS": 60000,
+    "connectTimeoutMS": 5000,
+    "serverSelectionTimeoutMS": 5000,
+    "socketTimeoutMS": 30000,
+    "readPreference": "primary",
+}
+
+
 class EntryNotFoundError(Exception):
     pass
 
 
+class RevisionConflictError(Exception):
+    """ the entry was written by someone else since it was read """
+    pass
+
+
+def content_key(lang, text):
+    """ stable id of a source text: BLAKE2 of its language and of the text,
+    NFC-normalized with whitespace collapsed """
+    normalized = " ".join(unicodedata.normalize("NFC", text).split())
+    return hashlib.blake2b(f"{lang}\n{normalized}".encode(),
+                           digest_size=16).hexdigest()
+
+
+def id_sort_key(id_):
+    """ order string ids like "2" < "10", for keyset pagination """
+    return len(id_), id_
+
+
+def fetch_page_ids(sorted_ids, limit, after=None, before=None):
+    """ ids to fetch for Page.from_fetched, from ids sorted by id_sort_key """
+    if before is None:
+        start = (0 if after is None
+                 else bisect.bisect_right(sorted_ids, id_sort_key(after),
+                                          key=id_sort_key))
+        return sorted_ids[start:start + limit + 1]
+    end = bisect.bisect_left(sorted_ids, id_sort_key(before), key=id_sort_key)
+    return sorted_ids[max(0, end - limit - 1):end][::-1]
+
+
+def iter_ids(dao, batch_size=1000):
+    """ every id of `dao`, in id order """
+    page = dao.list_summaries(limit=batch_size)
+    while page.items:
+        yield from (summary.id for summary in page.items)
+        if not page.has_next:
+            return
+        page = dao.list_summaries(limit=batch_size, after=page.last_id)
+
+
+def doc_langs(doc):
+    """ languages of an entry document, the source first, from info.langs
+    or, for older documents, from its sections """
+    info = doc["info"]
+    if "langs" in info:
+        return list(info["langs"])
+    return [info["src"]] + [key for key in doc
+                            if key not in ("_id", "info", "src")]
+
+
+def merge_partial(stored, doc):
+    """ the document `stored` with the sections and info of the partial
+    document `doc`, keeping the languages of both """
+    langs = list(dict.fromkeys(doc_langs(stored) + doc["info"]["langs"]))
+    return {**stored, **doc, "info": {**doc["info"], "langs": langs}}
+
+
+def lang_pairs(langs):
+    """ keys of the (source, target) index of EntryDAO.find for an entry of
+    languages `langs`, the source first; None stands for any language """
+    src = langs[0]
+    targets = [lang for lang in dict.fromkeys(langs[1:]) if lang != src]
+    return ([(src, None)] + [(None, lang) for lang in targets]
+            + [(src, lang) for lang in targets])
+
+
+def copy_entries(src, dst, batch_size=1000):
+    """ write every entry of `src` to `dst` under the same id, at the same
+    revision and modification time. Entries that `dst` already holds are
+    skipped, whatever their revision, so copying again only brings the new
+    entries. Returns the numbers of copied and skipped entries. """
+    copied = skipped = 0
+    for id_ in iter_ids(src, batch_size):
+        try:
+            dst.get_info(id_)
+        except EntryNotFoundError:
+            pass
+        else:
+            skipped += 1
+            continue
+        try:
+            dst.write_entry(id_, src.get_entry(id_), touch=False)
+            copied += 1
+        except RevisionConflictError:  # written in between
+            skipped += 1
+    if hasattr(dst, "commit"):
+        dst.commit()
+    return copied, skipped
+
+
+class Page:
+    def __init__(self, items, has_prev, has_next):
+        self.items = items
+        self.has_prev = has_prev
+        self.has_next = has_next
+
+    @property
+    def first_id(self):
+        return self.items[0].id if self.items else None
+
+    @property
+    def last_id(self):
+        return self.items[-1].id if self.items else None
+
+    @classmethod
+    def from_fetched(cls, items, limit, after=None, before=None):
+        """ `items` were fetched with `limit + 1`, ascending from `after` or
+        descending from `before` """
+        if before is None:
+            return cls(items[:limit], after is not None, len(items) > limit)
+        return cls(items[:limit][::-1], len(items) > limit, True)
+
+
 class EntryDAO:
-    def get_entry(id_):
+    def __init__(self):
+        self._listeners = []
+        self._ids_by_key = None  # built on first use by get_id_by_key
+        self._keys_by_id = None
+        self._ids_by_pair = None  # built on first use by find
+        self._pairs_by_id = None
+        self._pairs_lock = threading.RLock()
+
+    def on_change(self, callback):
+        """ `callback(id_)` is called after an entry is written or deleted """
+        self._listeners.append(callback)
+
+    def _changed(self, id_):
+        if self._ids_by_key is not None:
+            self._index_key(id_)
+        with self._pairs_lock:
+            if self._ids_by_pair is not None:
+                self._index_pairs(id_)
+        for callback in self._listeners:
+            callback(id_)
+
+    def _stored_key(self, id_, info):
+        """ key of a stored entry, computed for documents lacking one """
+        return info.get("key") or self.get_entry(id_, langs=()).key
+
+    def _index_key(self, id_):
+        self._ids_by_key.pop(self._keys_by_id.pop(id_, None), None)
+        try:
+            key = self._stored_key(id_, self.get_info(id_))
+        except EntryNotFoundError:
+            return
+        self._ids_by_key[key] = id_
+        self._keys_by_id[id_] = key
+
+    def get_id_by_key(self, key):
+        """ id of the entry whose source has this content_key, or None. By
+        default, from an index of every entry built on first call and kept
+        up to date on writes. """
+        if self._ids_by_key is None:
+            self._ids_by_key, self._keys_by_id = {}, {}
+            for id_ in iter_ids(self):
+                self._index_key(id_)
+        return self._ids_by_key.get(key)
+
+    def _find_keys(self, keys):
+        """ {key: (id, info)} for the stored entries among `keys` """
+        found = {}
+        for key in keys:
+            id_ = self.get_id_by_key(key)
+            if id_ is not None:
+                found[key] = (id_, self.get_info(id_))
+        return found
+
+    def import_entries(self, entries, merge=False, dry_run=False):
+        """ add `entries` unless already stored, as told by their key.
+        Stored entries whose import hash differs are "changed": left as
+        they are, or if `merge`, updated with the target languages that
+        are new or whose text changed. Returns a Counter of "new",
+        "changed" and "unchanged" entries; nothing is written if
+        `dry_run`. """
+        report = collections.Counter()
+        entries = list(entries)
+        found = self._find_keys(set(entry.key for entry in entries))
+        new = []
+        for entry in entries:
+            entry.import_hash = entry.content_hash()
+            key = entry.key
+            if key not in found:
+                found[key] = (None, {"hash": entry.import_hash})
+                new.append(entry)
+                report["new"] += 1
+                continue
+            id_, info = found[key]
+            if info.get("hash") == entry.import_hash:
+                report["unchanged"] += 1
+                continue
+            report["changed"] += 1
+            found[key] = (id_, {**info, "hash": entry.import_hash})
+            if merge and not dry_run:
+                self._merge_entry(id_, entry)
+        if new and not dry_run:
+            self.add_entries(new)
+        return report
+
+    def _merge_entry(self, id_, entry):
+        """ write the target languages of `entry` that `id_` lacks or whose
+        text differs, keeping the tokens and maps of the others """
+        if id_ is None:  # added by the same import, not written yet
+            return
+        stored = self.get_entry(id_)
+        for lang in entry.target_langs:
+            text, map_ = entry.get(lang)
+            if (lang not in stored.langs
+                    or stored.get_text(lang).str != text.str):
+                stored.add(text, map_)
+        stored.import_hash = entry.import_hash
+        self.write_entry(id_, stored)
+
+    def get_entry(self, id_, langs=None):
+        """ `langs`: target languages to fetch, all of them if None. The
+        source text is always fetched. """
+        raise NotImplementedError
+
+    def get_info(self, id_):
+        """ the "info" part of an entry: source language, revision... """
         raise NotImplementedError
 
-    def write_entry(self, id_, entry):
+    def write_entry(self, id_, entry, touch=True):
+        """ also touches `entry` (revision and modification time), unless
+        not `touch`: the entry is then written as it is, as when copied
+        from another DAO """
         raise NotImplementedError
 
+    def write_lang(self, id_, entry, lang, src=False):
+        """ write the section of `lang` of `entry`, and the source section
+        if `src`, provided the stored entry is still at `entry.revision`,
+        else raise RevisionConflictError. Also touches `entry`. By default,
+        written as a partial entry through write_entry. """
+        stored = self.get_entry(id_, langs=())
+        if stored.revision != entry.revision:
+            raise RevisionConflictError(id_)
+        section = Entry(entry.text_src if src else stored.text_src)
+        section.texts[lang] = entry.get(lang)
+        section.partial = True
+        section.revision = entry.revision
+        section.import_hash = stored.import_hash
+        self.write_entry(id_, section)
+        entry.revision, entry.mtime = section.revision, section.mtime
+
     def add_entry(self, entry):
+        """ returns the id of the new entry """
         raise NotImplementedError
 
+    def add_entries(self, entries):
+        """ returns the ids of the new entries """
+        return [self.add_entry(entry) for entry in entries]
+
     def delete_entry(self, id_):
         raise NotImplementedError
 
+    def list_summaries(self, limit=20, after=None, before=None):
+        """ a Page of EntrySummary, in id order, right after `after` or right
+        before `before` """
+        raise NotImplementedError
+
+    def get_summaries(self, ids):
+        """ the EntrySummary of each of `ids` """
+        raise NotImplementedError
+
+    def _entry_langs(self, id_):
+        """ languages of a stored entry, the source first """
+        langs = self.get_info(id_).get("langs")
+        return langs if langs is not None else self.get_entry(id_).langs
+
+    def _index_pairs(self, id_, langs=None, index=None):
+        """ put `id_` in the lists of `_ids_by_pair` of its languages,
+        `langs` or else as stored, out of them if it was deleted. `index`:
+        (ids by pair, pairs by id) being built instead. """
+        ids_by_pair, pairs_by_id = (
+            (self._ids_by_pair, self._pairs_by_id) if index is None
+            else index)
+        with self._pairs_lock:
+            sort_key = id_sort_key(id_)
+            for pair in pairs_by_id.pop(id_, ()):
+                ids = ids_by_pair[pair]
+                del ids[bisect.bisect_left(ids, sort_key, key=id_sort_key)]
+            if langs is None:
+                try:
+                    langs = self._entry_langs(id_)
+                except EntryNotFoundError:
+                    return
+            pairs = pairs_by_id[id_] = lang_pairs(langs)
+            for pair in pairs:
+                bisect.insort(ids_by_pair.setdefault(pair, []), id_,
+                              key=id_sort_key)
+
+    def find(self, src=None, target=None, limit=20, after=None, before=None):
+        """ as list_summaries, for the entries whose source language is
+        `src` and having a target language `target` (any if None). By
+        default, from an index of the ids of each (source, target) pair
+        built on first call and kept up to date on writes: writes wait for
+        the build, so that they are indexed after it. """
+        if src is None and target is None:
+            return self.list_summaries(limit, after, before)
+        with self._pairs_lock:
+            if self._ids_by_pair is None:
+                index = {}, {}
+                page = self.list_summaries(limit=FIND_SCAN_SIZE)
+                while page.items:
+                    for summary in page.items:
+                        self._index_pairs(summary.id, summary.langs, index)
+                    if not page.has_next:
+                        break
+                    page = self.list_summaries(limit=FIND_SCAN_SIZE,
+                                               after=page.last_id)
+                self._ids_by_pair, self._pairs_by_id = index
+            page_ids = fetch_page_ids(
+                self._ids_by_pair.get((src, target), []), limit, after,
+                before)
+        return Page.from_fetched(self.get_summaries(page_ids), limit, after,
+                                 before)
+
+
+class IdAllocator:
+    """ Allocates ids "0", "1"...: ids of deleted entries first, smallest
+    first, then from a counter. """
+    def __init__(self, next_id=0, free=()):
+        self.next_id = next_id
+        self.free = list(free)
+        heapq.heapify(self.free)
+
+    @classmethod
+    def from_ids(cls, ids):
+        used = set(int(id_) for id_ in ids if id_.isdigit())
+        next_id = max(used, default=-1) + 1
+        return cls(next_id, (i for i in range(next_id) if i not in used))
+
+    def allocate(self):
+        if self.free:
+            return str(heapq.heappop(self.free))
+        self.next_id += 1
+        return str(self.next_id - 1)
+
+    def reserve(self, id_):
+        """ mark an id chosen by the caller as used """
+        if not id_.isdigit():
+            return
+        i = int(id_)
+        if i >= self.next_id:
+            for j in range(self.next_id, i):
+                heapq.heappush(self.free, j)
+            self.next_id = i + 1
+        elif i in self.free:
+            self.free.remove(i)
+            heapq.heapify(self.free)
+
+    def release(self, id_):
+        if id_.isdigit():
+            heapq.heappush(self.free, int(id_))
+
+    def to_dict(self):
+        return {"next": self.next_id, "free": sorted(self.free)}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["next"], d["free"])
+
 
 class JsonDAO(EntryDAO):
-    def __init__(self, data_path=default_data_path):
+    """ data file: {"version": 2, "ids": IdAllocator.to_dict(), "entries": {id:
+    entry dict}}. Files holding only the entries still load. Encoded with
+    `codec_name`, by default from the extension of the file (see
+    codec.codec_for_path). """
+    def __init__(self, data_path=default_data_path, codec_name=None):
+        super().__init__()
         self.data_path = data_path
+        self.codec = (codec.codec_for_path(data_path) if codec_name is None
+                      else codec.get_codec(codec_name))
         self.texts = {}
+        self._sorted_ids = None
+        self.ids = IdAllocator()
 
         if os.path.exists(self.data_path):
-            with open(self.data_path) as f:
-                self.texts = json.load(f)
+            with open(self.data_path, "rb") as f:
+                content = codec.loads(f.read())
+            if content.get("version") == 2:
+                self.texts = content["entries"]
+                self.ids = IdAllocator.from_dict(content["ids"])
+            else:
+                self.texts = content
+                self.ids = IdAllocator.from_ids(self.texts)
 
-    def get_entry(self, id_):
+    def get_entry(self, id_, langs=None):
         try:
-            return Entry.from_dict(self.texts[id_])
+            return Entry.from_dict(self.texts[id_], langs)
         except KeyError:
             raise EntryNotFoundError()
 
-    def write_entry(self, id_, entry):
-        self.texts[id_] = entry.to_dict()
+    def get_info(self, id_):
+        try:
+            return self.texts[id_]["info"]
+        except KeyError:
+            raise EntryNotFoundError()
+
+    def write_entry(self, id_, entry, touch=True):
+        if id_ not in self.texts:
+            self._sorted_ids = None
+            self.ids.reserve(id_)
+        if touch:
+            entry.touch()
+        if entry.partial and id_ in self.texts:
+            self.texts[id_] = merge_partial(self.texts[id_], entry.to_dict())
+        else:
+            self.texts[id_] = entry.to_dict()
+        self._changed(id_)
 
     def add_entry(self, entry):
-        i = 0
-        for i, id_int in enumerate(sorted(map(int, self.texts.keys()))):
-            if i < id_int:
-                self.write_entry(str(i), entry)
-        new_id = str(i+1)
+        new_id = self.ids.allocate()
         self.write_entry(new_id, entry)
         return new_id
 
     def delete_entry(self, id_):
-        del self.texts[id_]
+        try:
+            del self.texts[id_]
+        except KeyError:
+            raise EntryNotFoundError()
+        self.ids.release(id_)
+        self._sorted_ids = None
+        self._changed(id_)
+
+    def list_summaries(self, limit=20, after=None, before=None):
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.texts, key=id_sort_key)
+        page_ids = fetch_page_ids(self._sorted_ids, limit, after, before)
+        summaries = self.get_summaries(page_ids)
+        return Page.from_fetched(summaries, limit, after, before)
+
+    def get_summaries(self, ids):
+        return [EntrySummary.from_dict(id_, self.texts[id_]) for id_ in ids]
 
     def commit(self):
-        with open(self.data_path, "w") as f:
-            json.dump(self.texts, f)
+        with open(self.data_path, "wb") as f:
+            f.write(self.codec.dumps({"version": 2, "ids": self.ids.to_dict(),
+                                      "entries": self.texts}))
+
+
+def _mongo_client(url, options):
+    import pymongo
+    return pymongo.MongoClient(url, **options)
 
 
 class MongoDAO(EntryDAO):
+    """ The client is made by `client_getter` on first use rather than when
+    the DAO is made, and made again in a process forked since, pymongo
+    clients not being fork-safe. """
     def __init__(self, client_getter, db_name, collection_name):
-        self.client = client_getter()
-        self.db = getattr(self.client, db_name)
-        self.texts = getattr(self.db, collection_name)
+        super().__init__()
+        self.client_getter = client_getter
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self._client = None
+        self._texts = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._indexed = False
+
+    @classmethod
+    def from_url(cls, url, collection_name="text", **options):
+        """ `url`: mongodb connection string, whose path is the database
+        (lang_db by default). MONGO_OPTIONS that neither the url nor
+        `options` give are added. """
+        parsed = urllib.parse.urlsplit(url)
+        db_name = parsed.path.strip("/") or "lang_db"
+        given = set(map(str.lower, urllib.parse.parse_qs(parsed.query)))
+        given.update(map(str.lower, options))
+        options = {**{k: v for k, v in MONGO_OPTIONS.items()
+                      if k.lower() not in given}, **options}
+        return cls(functools.partial(_mongo_client, url, options), db_name,
+                   collection_name)
+
+    def _connect(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._client = self.client_getter()
+                self._texts = getattr(getattr(self._client, self.db_name),
+                                      self.collection_name)
+                self._pid = os.getpid()
+                if not self._indexed:
+                    self.ensure_indexes()
+
+    @property
+    def client(self):
+        if self._pid != os.getpid():
+            self._connect()
+        return self._client
+
+    @property
+    def texts(self):
+        if self._pid != os.getpid():
+            self._connect()
+        return self._texts
+
+    def ensure_indexes(self):
+        """ made when first connecting: a unique index on the content key,
+        and indexes on the languages for `find`. info.langs and info.key
+        are first set on the documents lacking them; a document whose
+        source duplicates another one is left without key. """
+        import pymongo.errors
+        self._texts.create_index(
+            "info.key", unique=True,
+            partialFilterExpression={"info.key": {"$exists": True}})
+        self._texts.create_index([("info.src", 1), ("_id", 1)])
+        self._texts.create_index([("info.langs", 1), ("_id", 1)])
+        self._texts.create_index([("info.src", 1), ("info.langs", 1),
+                                  ("_id", 1)])
+        missing = self._texts.aggregate([
+            {"$match": {"info.langs": None}},
+            {"$project": {"info.src": 1, "keys": {"$map": {
+                "input": {"$objectToArray": "$$ROOT"}, "in": "$$this.k"}}}},
+        ])
+        for doc in missing:
+            langs = doc_langs({**dict.fromkeys(doc["keys"]),
+                               "info": doc["info"]})
+            self._texts.update_one({"_id": doc["_id"]},
+                                   {"$set": {"info.langs": langs}})
+        for doc in self._texts.find({"info.key": {"$exists": False}},
+                                    {"info.src": 1, "src.text": 1}):
+            key = content_key(doc["info"]["src"], doc["src"]["text"])
+            try:
+                self._texts.update_one({"_id": doc["_id"]},
+                                       {"$set": {"info.key": key}})
+            except pymongo.errors.DuplicateKeyError:
+                pass
+        self._indexed = True
 
     @staticmethod
     def _doc_to_entry(doc):
@@ -73,67 +577,574 @@ class MongoDAO(EntryDAO):
             del doc["_id"]
         return Entry.from_dict(doc), _id
 
-    def get_entry(self, id_):
-        doc = self.texts.find_one({"_id": id_})
+    def get_entry(self, id_, langs=None):
+        projection = (None if langs is None
+                      else dict.fromkeys(["info", "src", *langs], 1))
+        doc = self.texts.find_one({"_id": id_}, projection)
         if doc is None:
             raise EntryNotFoundError()
-        entry, _ = self._doc_to_entry(doc)
-        return entry
+        del doc["_id"]
+        return Entry.from_dict(doc, langs)
+
+    def get_info(self, id_):
+        doc = self.texts.find_one({"_id": id_}, {"info": 1})
+        if doc is None:
+            raise EntryNotFoundError()
+        return doc["info"]
 
     def iter_all(self, limit=None):
-        for count, doc in enumerate(self.texts.find({})):
-            if count >= limit:
-                return
+        cursor = self.texts.find({})
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        for doc in cursor:
             yield self._doc_to_entry(doc)
 
-    def write_entry(self, id_, entry):
-        entry_dict = entry.do_dict()
-        entry_dict["_id"] = id_
-        self.texts.insert_one(entry_dict)
+    def list_summaries(self, limit=20, after=None, before=None):
+        return self.find(limit=limit, after=after, before=before)
+
+    def _cursor_id(self, id_):
+        """ the `_id` of a page cursor given as a string, by the query
+        string: legacy documents have int ids """
+        if (isinstance(id_, str) and id_.lstrip("-").isdigit()
+                and self.texts.count_documents({"_id": id_}, limit=1) == 0):
+            return int(id_)
+        return id_
+
+    @staticmethod
+    def _id_range(operator, id_):
+        """ $gt and $lt only compare values of the same BSON type, and
+        numbers sort before strings: the strings come after an int id, the
+        numbers before a string id """
+        if isinstance(id_, int) and operator == "$gt":
+            return {"$or": [{"_id": {"$gt": id_}},
+                            {"_id": {"$type": "string"}}]}
+        if isinstance(id_, str) and operator == "$lt":
+            return {"$or": [{"_id": {"$lt": id_}},
+                            {"_id": {"$type": "number"}}]}
+        return {"_id": {operator: id_}}
+
+    def find(self, src=None, target=None, limit=20, after=None, before=None):
+        """ a scan of the indexes on info.src and info.langs """
+        import pymongo
+        if before is None:
+            match = ({} if after is None
+                     else self._id_range("$gt", self._cursor_id(after)))
+            order = pymongo.ASCENDING
+        else:
+            match = self._id_range("$lt", self._cursor_id(before))
+            order = pymongo.DESCENDING
+        src_filter = {}
+        if src is not None:
+            src_filter["$eq"] = src
+        if target is not None:  # info.langs also holds the source
+            match["info.langs"] = target
+            src_filter["$ne"] = target
+        if src_filter:
+            match["info.src"] = src_filter
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"_id": order}},
+            {"$limit": limit + 1},
+            # one extra char tells whether the text was cut
+            {"$project": {
+                "info.src": 1,
+                "beginning": {"$substrCP": ["$src.text", 0, SUMMARY_SIZE + 1]},
+                "langs": {"$map": {"input": {"$objectToArray": "$$ROOT"},
+                                   "in": "$$this.k"}},
+            }},
+        ]
+        summaries = [EntrySummary.from_projection(doc)
+                     for doc in self.texts.aggregate(pipeline)]
+        return Page.from_fetched(summaries, limit, after, before)
+
+    @staticmethod
+    def _revision_filter(id_, revision):
+        if revision == 0:  # older documents have no revision
+            return {"_id": id_, "$or": [{"info.rev": 0},
+                                        {"info.rev": {"$exists": False}}]}
+        return {"_id": id_, "info.rev": revision}
+
+    def write_entry(self, id_, entry, touch=True):
+        """ replaces the document (only sets its sections if `entry` is
+        partial) if still at `entry.revision`, else raise
+        RevisionConflictError """
+        import pymongo.errors
+        revision, mtime = entry.revision, entry.mtime
+        if touch:
+            entry.touch()
+        doc = entry.to_dict()
+        query = self._revision_filter(id_, revision)
+        try:
+            if entry.partial:
+                info = doc.pop("info")
+                langs = info.pop("langs")
+                doc.update((f"info.{key}", value)
+                           for key, value in info.items())
+                self.texts.update_one(
+                    query, {"$set": doc,
+                            "$addToSet": {"info.langs": {"$each": langs}}},
+                    upsert=True)
+            else:
+                self.texts.replace_one(query, doc, upsert=True)
+        except pymongo.errors.DuplicateKeyError:  # exists at another revision
+            entry.revision, entry.mtime = revision, mtime
+            raise RevisionConflictError(id_)
+        self._changed(id_)
+
+    def write_lang(self, id_, entry, lang, src=False):
+        """ $set of the section of `lang` only (and of the source section if
+        `src`), with a compare-and-set on the revision """
+        revision, mtime = entry.revision, entry.mtime
+        entry.touch()
+        update = {"info.rev": entry.revision, "info.mtime": entry.mtime,
+                  lang: entry.section(lang)}
+        if src:
+            update["src"] = entry.text_src.to_dict()
+        result = self.texts.update_one(self._revision_filter(id_, revision),
+                                       {"$set": update,
+                                        "$addToSet": {"info.langs": lang}})
+        if result.matched_count == 0:
+            entry.revision, entry.mtime = revision, mtime
+            if self.texts.count_documents({"_id": id_}, limit=1) == 0:
+                raise EntryNotFoundError()
+            raise RevisionConflictError(id_)
+        self._changed(id_)
 
     def add_entry(self, entry):
+        """ the id is the content key of the entry """
+        entry.touch()
         doc = entry.to_dict()
-        doc["_id"] = hash(doc["src"]["text"])
+        doc["_id"] = doc["info"]["key"]
         self.texts.insert_one(doc)
+        self._changed(doc["_id"])
+        return doc["_id"]
+
+    def add_entries(self, entries):
+        """ entries whose id already exists are not inserted, their id is
+        None in the result """
+        import pymongo.errors
+        docs = []
+        for entry in entries:
+            entry.touch()
+            doc = entry.to_dict()
+            doc["_id"] = doc["info"]["key"]
+            docs.append(doc)
+        if not docs:
+            return []
+        ids = [doc["_id"] for doc in docs]
+        try:
+            self.texts.insert_many(docs, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                if error["code"] != 11000:  # duplicate key
+                    raise
+                ids[error["index"]] = None
+        for id_ in ids:
+            if id_ is not None:
+                self._changed(id_)
+        return ids
+
+    def get_id_by_key(self, key):
+        doc = self.texts.find_one({"info.key": key}, {"_id": 1})
+        return None if doc is None else doc["_id"]
+
+    def _find_keys(self, keys):
+        """ a single query for a batch of keys """
+        return {doc["info"]["key"]: (doc["_id"], doc["info"])
+                for doc in self.texts.find({"info.key": {"$in": list(keys)}},
+                                           {"info": 1})}
 
     def delete_entry(self, _id):
         doc = self.texts.find_one_and_delete({"_id": _id})
         del doc["_id"]
+        self._changed(_id)
         return Entry.from_dict(doc)
 
 
+class EntrySummary:
+    """ What listings need from an entry: id, source language, the beginning
+    of the source text and the languages, without tokens nor maps. """
+    __slots__ = ("id", "lang_src", "beginning", "langs")
+
+    def __init__(self, id_, lang_src, beginning, langs, size=SUMMARY_SIZE):
+        self.id = id_
+        self.lang_src = lang_src
+        self.beginning = beginning[:size] + "..." * (len(beginning) > size)
+        self.langs = tuple(langs)
+
+    @property
+    def target_langs(self):
+        return tuple(filter(lambda l: l != self.lang_src, self.langs))
+
+    @classmethod
+    def from_dict(cls, id_, d):
+        lang_src = d["info"]["src"]
+        langs = [lang_src] + [lang for lang in d if lang not in ("info", "src")]
+        return cls(id_, lang_src, d["src"]["text"], langs)
+
+    @classmethod
+    def from_projection(cls, doc):
+        lang_src = doc["info"]["src"]
+        langs = [lang_src] + [lang for lang in doc["langs"]
+                              if lang not in ("_id", "info", "src")]
+        return cls(doc["_id"], lang_src, doc["beginning"], langs)
+
+
+class Vocabulary:
+    """ Distinct tokens of a text interned to ids, starting from the
+    "vocab" of its packed tokens if any. Being the text's own, it lives as
+    long as the text, and is not shared between threads. """
+    __slots__ = ("ids", "tokens")
+
+    def __init__(self, tokens=()):
+        self.ids = None  # token -> id, made on first encode
+        self.tokens = list(tokens)
+
+    def encode(self, tokens):
+        ids = self.ids
+        if ids is None:
+            ids = self.ids = {token: i for i, token in enumerate(self.tokens)}
+        for token in tokens:
+            if token not in ids:
+                ids[token] = len(self.tokens)
+                self.tokens.append(token)
+        return array.array("I", map(ids.__getitem__, tokens))
+
+    def decode(self, ids):
+        return list(map(self.tokens.__getitem__, ids))
+
+
+def pack_tokens(tokens, vocab=None):
+    """ {"vocab": distinct tokens, "ids": base64 of their index for each
+    token, little-endian, "type": array typecode of the ids}. `tokens` may
+    be ids of the Vocabulary `vocab`. """
+    local = {}
+    idxs = [local.setdefault(token, len(local)) for token in tokens]
+    typecode = ("B" if len(local) <= 2**8 else
+                "H" if len(local) <= 2**16 else "I")
+    packed = array.array(typecode, idxs)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return {"vocab": list(local) if vocab is None else vocab.decode(local),
+            "ids": base64.b64encode(packed).decode(), "type": typecode}
+
+
+def _unpack_idxs(packed):
+    idxs = array.array(packed["type"], base64.b64decode(packed["ids"]))
+    if sys.byteorder == "big":
+        idxs.byteswap()
+    return idxs
+
+
+def unpack_tokens(packed):
+    return list(map(packed["vocab"].__getitem__, _unpack_idxs(packed)))
+
+
+def section_tokens(d):
+    """ tokens of a section, packed (see pack_tokens) or a list """
+    tokens = d["tokens"]
+    return unpack_tokens(tokens) if isinstance(tokens, dict) else tokens
+
+
+def section_size(d):
+    """ number of tokens of a section, without decoding them """
+    tokens = d["tokens"]
+    return len(_unpack_idxs(tokens) if isinstance(tokens, dict) else tokens)
+
+
+def pack_groups(groups):
+    """ {"members": for each side, the token indexes of every group one
+    after the other, "bounds": for each side, the start of every group in
+    "members", and the end of the last one} """
+    groups = groups if isinstance(groups, (list, tuple)) else list(groups)
+    return {"members": [list(itertools.chain.from_iterable(
+                            group[side] for group in groups))
+                        for side in (0, 1)],
+            "bounds": [list(itertools.accumulate(
+                           (len(group[side]) for group in groups), initial=0))
+                       for side in (0, 1)]}
+
+
+def _split_sides(packed):
+    """ for each side, the list of the token indexes of every group """
+    return [[members[start:end] for start, end in zip(bounds, bounds[1:])]
+            for members, bounds in zip(packed["members"], packed["bounds"])]
+
+
+def unpack_groups(packed):
+    return [list(group) for group in zip(*_split_sides(packed))]
+
+
+def section_groups(d):
+    """ groups of the map of a section, packed (see pack_groups) or a
+    list """
+    groups = d["map"]
+    return unpack_groups(groups) if isinstance(groups, dict) else groups
+
+
 class Text:
-    def __init__(self, lang, str_, tokens=None):
+    """ Tokens are kept as an array of ids of the vocabulary of the text,
+    the list of strings being decoded when first used. Change
+    them through `set_tokens`. The packed tokens read by `from_dict` are
+    written back as they are by `to_dict`. """
+    __slots__ = ("lang", "str", "vocab", "_tokens", "_token_ids",
+                 "_segments", "_char_offsets", "_packed")
+
+    def __init__(self, lang, str_, tokens=None, segments=None, vocab=None):
+        """ `tokens` may be an array (or a memoryview) of ids of the
+        Vocabulary `vocab` """
         self.lang = lang
         self.str = str_
-        self.tokens = tokens if tokens else []
+        self.vocab = Vocabulary() if vocab is None else vocab
+        self._tokens = None
+        self._token_ids = None
+        self._packed = None
+        if isinstance(tokens, (array.array, memoryview)):
+            self._token_ids = tokens
+        else:
+            self._tokens = list(tokens) if tokens else []
+        self._segments = segments
+        self._char_offsets = None
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = self.vocab.decode(self._token_ids)
+        return self._tokens
+
+    @property
+    def token_ids(self):
+        """ array("I") of vocabulary ids, equal for equal tokens """
+        if self._token_ids is None:
+            self._token_ids = self.vocab.encode(self._tokens)
+        return self._token_ids
+
+    @property
+    def n_tokens(self):
+        if self._token_ids is not None:
+            return len(self._token_ids)
+        return len(self._tokens)
+
+    @property
+    def segments(self):
+        """ start offsets of segments, see tokenizer.segment_starts """
+        if self._segments is None:
+            self._segments = tokenizer.segment_starts(self.tokens)
+        return self._segments
+
+    def segment_bounds(self, i):
+        starts = self.segments
+        if i >= len(starts):
+            return self.n_tokens, self.n_tokens
+        return starts[i], starts[i + 1] if i + 1 < len(starts) else self.n_tokens
+
+    @property
+    def char_offsets(self):
+        """ char index of each token in `str`, and of the end, see
+        tokenizer.token_offsets """
+        if self._char_offsets is None:
+            self._char_offsets = tokenizer.token_offsets(self.tokens,
+                                                         self.str)
+        return self._char_offsets
+
+    def token_span(self, i):
+        return self.char_offsets[i], self.char_offsets[i + 1]
+
+    def token_at_char(self, char_idx):
+        return bisect.bisect_right(self.char_offsets, char_idx) - 1
 
     def set_tokens(self, tokens):
-        self.tokens = tokens
+        self._tokens = list(tokens)
+        self._token_ids = None
+        self.vocab = Vocabulary()
+        self._packed = None
+        self._segments = None
+        self._char_offsets = None
+
+    @classmethod
+    def from_dict(cls, lang, d):
+        tokens = packed = d["tokens"]
+        vocab = None
+        if isinstance(packed, dict):
+            vocab = Vocabulary(packed["vocab"])
+            tokens = array.array("I", _unpack_idxs(packed))
+        text = cls(lang, d["text"], tokens, d.get("segments"), vocab)
+        if isinstance(packed, dict):
+            text._packed = packed
+        return text
 
     def to_dict(self):
-        return {"text": self.str, "tokens": self.tokens}
+        if self._packed is None:
+            self._packed = (
+                pack_tokens(self._tokens) if self._token_ids is None
+                else pack_tokens(self._token_ids, self.vocab))
+        return {"text": self.str, "tokens": self._packed,
+                "segments": list(self.segments)}
+
+
+class Alignment:
+    """ Groups of aligned tokens, `groups[i] = (idxs_src, idxs_tgt)`, with
+    for each side an array giving the group of every token (-1 if none).
+    The groups are stored as for pack_groups, in arrays. """
+    __slots__ = ("index", "_members", "_bounds")
+
+    def __init__(self, groups=(), sizes=(0, 0), index=None):
+        packed = pack_groups(groups)
+        self._members = tuple(array.array("i", m) for m in packed["members"])
+        self._bounds = tuple(array.array("i", b) for b in packed["bounds"])
+        self.index = (self._build_index(sizes) if index is None
+                      else tuple(self._as_array(idx) for idx in index))
+
+    @staticmethod
+    def _as_array(idx):
+        """ memoryviews (of a mapped corpus) are used as they are """
+        if isinstance(idx, (array.array, memoryview)):
+            return idx
+        return array.array("i", idx)
+
+    def _build_index(self, sizes):
+        index = []
+        for members, bounds, size in zip(self._members, self._bounds, sizes):
+            size = max(size, max(members, default=-1) + 1)
+            idx = array.array("i", [-1]) * size
+            for igroup in range(len(bounds) - 1):
+                for i in members[bounds[igroup]:bounds[igroup + 1]]:
+                    idx[i] = igroup
+            index.append(idx)
+        return tuple(index)
+
+    def _side(self, side, igroup):
+        bounds = self._bounds[side]
+        return self._members[side][bounds[igroup]:bounds[igroup + 1]].tolist()
+
+    def __getitem__(self, igroup):
+        if igroup < 0:
+            igroup += len(self)
+        if not 0 <= igroup < len(self):
+            raise IndexError(igroup)
+        return self._side(0, igroup), self._side(1, igroup)
+
+    def __iter__(self):
+        return zip(*_split_sides(self._packed()))
+
+    def __len__(self):
+        return len(self._bounds[0]) - 1
+
+    @property
+    def groups(self):
+        return list(self)
+
+    def group_of(self, side, idx):
+        index = self.index[side]
+        return index[idx] if idx < len(index) else -1
+
+    def crossing_bounds(self, cuts, size_src, size_tgt):
+        """ (ends, starts): for each of the sorted `cuts` of the source, the
+        end of the target tokens aligned with source tokens before the cut,
+        and the first target token aligned with source tokens from the cut
+        on (`size_tgt` if none). No group crosses the i-th cut of the source
+        and the cut `b` of the target if ends[i] <= b <= starts[i]. """
+        index_src = self.index[0][:size_src]
+        index_tgt = self.index[1][:size_tgt]
+        # by group, after its last target token and its first target token
+        ends_of = dict(zip(index_tgt, range(1, len(index_tgt) + 1)))
+        starts_of = dict(zip(reversed(index_tgt),
+                             reversed(range(len(index_tgt)))))
+        ends_of.pop(-1, None)
+        starts_of.pop(-1, None)
+        bounds = [0, *cuts, size_src]
+        chunks = [index_src[start:end]
+                  for start, end in zip(bounds, bounds[1:])]
+        ends = itertools.accumulate(
+            (max(map(ends_of.get, chunk, itertools.repeat(0)), default=0)
+             for chunk in chunks[:-1]), max)
+        starts = itertools.accumulate(
+            (min(map(starts_of.get, chunk, itertools.repeat(size_tgt)),
+                 default=size_tgt)
+             for chunk in reversed(chunks[1:])), min)
+        return list(ends), list(starts)[::-1]
+
+    def _packed(self):
+        return {"members": [members.tolist() for members in self._members],
+                "bounds": [bounds.tolist() for bounds in self._bounds]}
+
+    @classmethod
+    def from_dict(cls, d, size_src=0):
+        """ `d` is a text section; old ones only have "map", as a list of
+        groups """
+        packed, index = d["map"], d.get("map_index")
+        if not isinstance(packed, dict):
+            return cls(packed, (size_src, section_size(d)), index)
+        alignment = cls.__new__(cls)
+        alignment._members = tuple(map(cls._as_array, packed["members"]))
+        alignment._bounds = tuple(map(cls._as_array, packed["bounds"]))
+        alignment.index = (
+            alignment._build_index((size_src, section_size(d)))
+            if index is None else tuple(map(cls._as_array, index)))
+        return alignment
+
+    def to_dict(self):
+        return {"map": self._packed(),
+                "map_index": [idx.tolist() for idx in self.index]}
 
 
 class Entry:
+    """ Texts of target languages read from a dict are kept as is in `_raw`,
+    and only decoded when accessed. `partial` entries were read with only
+    some of their languages. """
+    __slots__ = ("lang_src", "text_src", "texts", "_raw", "partial",
+                 "revision", "mtime", "import_hash")
+
     def __init__(self, text_src):
         self.lang_src = text_src.lang
         self.text_src = text_src
         self.texts = {text_src.lang: (text_src, None)}
+        self._raw = {}
+        self.partial = False
+        self.revision = 0
+        self.mtime = None
+        self.import_hash = None  # content_hash when last imported
+
+    @property
+    def key(self):
+        return content_key(self.lang_src, self.text_src.str)
+
+    def content_hash(self):
+        """ BLAKE2 of the texts, tokens and maps, whatever the format of
+        the tokens and maps """
+        doc = self.to_dict()
+        del doc["info"]
+        for lang, section in doc.items():
+            # sections may be the undecoded dicts held by the DAO
+            d = doc[lang] = dict(section)
+            d["tokens"] = section_tokens(d)
+            if "map" in d:
+                d["map"] = section_groups(d)
+        return hashlib.blake2b(json.dumps(doc, sort_keys=True).encode(),
+                               digest_size=16).hexdigest()
 
     @property
     def langs(self):
-        return tuple(self.texts)
+        return tuple(self.texts) + tuple(self._raw)
 
     @property
     def target_langs(self):
-        return tuple(filter(lambda l: l != self.lang_src, self.texts))
+        return tuple(filter(lambda l: l != self.lang_src, self.langs))
 
-    def add(self, text, map_=()):
+    def _alignment(self, text, map_):
+        if map_ is None or isinstance(map_, Alignment):
+            return map_
+        return Alignment(map_, (self.text_src.n_tokens, text.n_tokens))
 
-        self.texts[text.lang] = (text, map_)
+    def add(self, text, map_=()):
+        self._raw.pop(text.lang, None)
+        self.texts[text.lang] = (text, self._alignment(text, map_))
 
     def get(self, lang):
+        if lang not in self.texts:
+            d = self._raw.pop(lang)
+            self.texts[lang] = (Text.from_dict(lang, d),
+                                Alignment.from_dict(d, self.text_src.n_tokens))
         return self.texts[lang]
 
     def get_text(self, lang):
@@ -142,27 +1153,132 @@ class Entry:
     def get_map(self, lang):
         return self.get(lang)[1]
 
+    def segment_pairs(self, lang):
+        """ bounds ((start, end) in the source, (start, end) in the text of
+        `lang`) of the segments to show side by side: the source is cut at
+        starts of its segments that no group of the map crosses, and the
+        text of `lang` at one of its own segment starts if it can be. Bounds
+        may be empty, (start, start), on one side, where the tokens of the
+        other side are aligned with nothing there, or with nothing at all:
+        the pair is then shown with an empty segment on that side. """
+        text_src, (text, alignment) = self.text_src, self.get(lang)
+        size_src, size_tgt = text_src.n_tokens, text.n_tokens
+        if not size_src and not size_tgt:
+            return []
+        cuts = text_src.segments[1:]
+        ends, starts = alignment.crossing_bounds(cuts, size_src, size_tgt)
+        starts_tgt = text.segments
+        pairs = []
+        start_src = start_tgt = 0
+        for cut_src, end, start in zip(cuts, ends, starts):
+            lo, hi = max(start_tgt, end), start
+            if lo > hi:  # crossed by a group
+                continue
+            i = bisect.bisect_left(starts_tgt, max(lo, start_tgt + 1))
+            cut_tgt = (starts_tgt[i] if i < len(starts_tgt)
+                       and starts_tgt[i] <= hi else lo)
+            pairs.append(((start_src, cut_src), (start_tgt, cut_tgt)))
+            start_src, start_tgt = cut_src, cut_tgt
+        pairs.append(((start_src, size_src), (start_tgt, size_tgt)))
+        return pairs
+
     def set(self, lang, text=None, map_=None):
-        text_old, map_old = self.texts[lang]
-        self.texts[lang] = (text if text is not None else text_old,
-                            map_ if map_ is not None else map_old)
+        text_old, map_old = self.get(lang)
+        text = text if text is not None else text_old
+        self.texts[lang] = (text,
+                            self._alignment(text, map_) if map_ is not None
+                            else map_old)
 
     @classmethod
-    def from_dict(cls, d):
+    def from_dict(cls, d, langs=None):
         lang_src = d["info"]["src"]
-        text_src = Text(lang_src, d["src"]["text"], d["src"]["tokens"])
-        entry = cls(text_src)
+        entry = cls(Text.from_dict(lang_src, d["src"]))
         for lang, d_ in d.items():
-            if lang not in ("info", "src"):
-                entry.add(Text(lang, d_["text"], d_["tokens"]), d_["map"])
+            if lang not in ("info", "src") and (langs is None or lang in langs):
+                entry._raw[lang] = d_
+        entry.partial = langs is not None
+        entry.revision = d["info"].get("rev", 0)
+        entry.mtime = d["info"].get("mtime")
+        entry.import_hash = d["info"].get("hash")
         return entry
 
+    def touch(self):
+        self.revision += 1
+        self.mtime = int(time.time())
+
     def to_dict(self):
-        base = {"info": {"src": self.lang_src},
+        base = {"info": {"src": self.lang_src, "langs": list(self.langs),
+                         "rev": self.revision, "mtime": self.mtime,
+                         "key": self.key, "hash": self.import_hash},
                 "src": self.text_src.to_dict()}
-        base.update({lang: {**text.to_dict(), "map": map_}
-                     for lang, (text, map_) in self.texts.items() if map_ is not None})
+        base.update({lang: self.section(lang)
+                     for lang, (_, map_) in self.texts.items() if map_ is not None})
+        base.update({lang: self._complete_section(d)
+                     for lang, d in self._raw.items()})
         return base
 
+    def section(self, lang):
+        """ the dict of a target language: text, tokens, segments, map """
+        if lang in self._raw:
+            return self._complete_section(self._raw[lang])
+        text, map_ = self.texts[lang]
+        return {**text.to_dict(), **map_.to_dict()}
+
+    def _complete_section(self, d):
+        """ add what older documents lack to an undecoded section, and turn
+        arrays (memoryviews of a mapped corpus) into lists """
+        if (isinstance(d.get("segments"), list)
+                and isinstance(d.get("map_index", [None])[0], list)):
+            return d
+        segments = d.get("segments")
+        return {**d,
+                **Alignment.from_dict(d, self.text_src.n_tokens).to_dict(),
+                "segments": (tokenizer.segment_starts(section_tokens(d))
+                             if segments is None else list(segments))}
+
+
+def dao_from_url(url):
+    """ json://path, journal://path and sqlite://path (the default files
+    if no path), mapped://path of a corpus (see corpus.py), or a mongodb://
+    connection string (see MongoDAO.from_url) """
+    scheme, _, path = url.partition("://")
+    if scheme == "json":
+        return JsonDAO(path or default_data_path)
+    if scheme == "journal":
+        import journal
+        return journal.JournalDAO(path or journal.default_journal_path)
+    if scheme == "sqlite":
+        import sqldb
+        return sqldb.SqliteDAO(path or sqldb.default_sqlite_path)
+    if scheme == "mapped":
+        import corpus
+        return corpus.MappedDAO(path)
+    if scheme in ("mongodb", "mongodb+srv"):
+        return MongoDAO.from_url(url)
+    raise ValueError(f"unknown DAO url {url!r}")
+
+
+_dao = None
+_dao_lock = threading.Lock()
+
+
+def get_dao():
+    """ the DAO of the LANG_DAO url (see dao_from_url), DEFAULT_DAO_URL if
+    not set, made on first call. LANG_CORPUS, the path of a corpus, is
+    still read if LANG_DAO is not set. The DAO can be made before forking
+    workers: a MongoDAO connects in each process on first use. """
+    global _dao
+    with _dao_lock:
+        if _dao is None:
+            url = os.environ.get("LANG_DAO")
+            if url is None and os.environ.get("LANG_CORPUS"):
+                url = "mapped://" + os.environ["LANG_CORPUS"]
+            _dao = dao_from_url(url or DEFAULT_DAO_URL)
+    return _dao
+
 
-DAO = MongoDAO(pymongo.MongoClient, "lang_db", "text")
+def __getattr__(name):
+    """ `data.DAO` is made on first access, see get_dao """
+    if name == "DAO":
+        return get_dao()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
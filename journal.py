@@ -0,0 +1,335 @@
+import argparse
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+import codec
+import data
+
+default_journal_path = os.path.join(data.data_folder_path, "data.journal")
+
+# record: header, id (utf-8), payload (an encoded document for PUT, empty
+# for DELETE). crc covers op, id and payload.
+HEADER = struct.Struct("<IIBH")  # crc, payload length, op, id length
+PUT = 1
+DELETE = 2
+
+
+class CorruptJournalError(Exception):
+    """ a record before the end of a journal fails its crc """
+    def __init__(self, path, offset):
+        super().__init__(f"{path}: corrupted record at byte {offset}")
+        self.path = path
+        self.offset = offset
+
+
+class Journal:
+    """ Append-only log of put/delete records, keyed by id. An in-memory
+    index gives the position of the last payload of each id, so reading one
+    document is a single pread. Writes are fsynced every `sync_every`
+    records (and on `sync`). A torn record at the end of the file, left by a
+    crash, is dropped when opening: an invalid record is taken as torn only
+    if no valid record follows it, the header lengths not being covered by
+    the crc. A corrupted record before the end raises CorruptJournalError,
+    unless `skip_corrupted`: the bytes up to the next valid record are then
+    skipped, and their offset is kept in `corrupted`. When dead records take more than `compact_ratio` of the
+    file, it is rewritten in a background thread.
+    A journal file is meant to be opened by a single process. """
+    def __init__(self, path, sync_every=64, compact_ratio=0.5,
+                 compact_min_size=2**20, skip_corrupted=False):
+        self.path = path
+        self.skip_corrupted = skip_corrupted
+        self.corrupted = []  # offsets of the records skipped by _load
+        self.sync_every = sync_every
+        self.compact_ratio = compact_ratio
+        self.compact_min_size = compact_min_size
+        self.index = {}  # id -> (payload offset, payload length)
+        self.size = 0
+        self.live_size = 0
+        self._unsynced = 0
+        self._lock = threading.RLock()
+        self._compaction = None
+        self._file = open(path, "a+b", buffering=0)
+        self._load()
+
+    @staticmethod
+    def _record_size(id_bytes, length):
+        return HEADER.size + len(id_bytes) + length
+
+    @staticmethod
+    def _read_record(file, offset, end):
+        """ (op, id, payload offset, payload length, offset of the next
+        record) of the record at `offset`, None if it goes past `end` or
+        fails its crc """
+        if offset + HEADER.size > end:
+            return None
+        crc, length, op, id_len = HEADER.unpack(
+            os.pread(file.fileno(), HEADER.size, offset))
+        body_offset = offset + HEADER.size
+        next_offset = body_offset + id_len + length
+        if next_offset > end:
+            return None
+        body = os.pread(file.fileno(), id_len + length, body_offset)
+        if zlib.crc32(bytes([op]) + body) != crc:
+            return None
+        return (op, body[:id_len].decode(), body_offset + id_len, length,
+                next_offset)
+
+    def _iter_records(self, file, start, end):
+        """ yield (offset, op, id, payload offset, payload length), stop at
+        the first torn or corrupted record """
+        offset = start
+        while offset < end:
+            record = self._read_record(file, offset, end)
+            if record is None:
+                return
+            op, id_, payload_offset, length, next_offset = record
+            yield offset, op, id_, payload_offset, length
+            offset = next_offset
+
+    def _apply(self, index, op, id_, payload_offset, length):
+        old = index.pop(id_, None)
+        if old is not None:
+            self.live_size -= self._record_size(id_.encode(), old[1])
+        if op == PUT:
+            index[id_] = (payload_offset, length)
+            self.live_size += self._record_size(id_.encode(), length)
+
+    def _load(self):
+        end = os.path.getsize(self.path)
+        offset = 0
+        while offset < end:
+            record = self._read_record(self._file, offset, end)
+            if record is None:
+                next_offset = self._find_record(offset + 1, end)
+                if next_offset is None:
+                    self._file.truncate(offset)  # torn write, of the last one
+                    break
+                if not self.skip_corrupted:
+                    raise CorruptJournalError(self.path, offset)
+                self.corrupted.append(offset)
+                offset = next_offset
+                continue
+            op, id_, payload_offset, length, next_offset = record
+            self._apply(self.index, op, id_, payload_offset, length)
+            offset = next_offset
+        self.size = offset
+
+    def _find_record(self, start, end):
+        """ offset of the first valid record at or after `start`, found byte
+        by byte, None if there is none """
+        if end - start < HEADER.size:
+            return None
+        with mmap.mmap(self._file.fileno(), end,
+                       access=mmap.ACCESS_READ) as view:
+            for offset in range(start, end - HEADER.size + 1):
+                crc, length, op, id_len = HEADER.unpack_from(view, offset)
+                body_offset = offset + HEADER.size
+                next_offset = body_offset + id_len + length
+                if (op in (PUT, DELETE) and next_offset <= end
+                        and zlib.crc32(view[body_offset:next_offset],
+                                       zlib.crc32(bytes([op]))) == crc):
+                    return offset
+        return None
+
+    def __contains__(self, id_):
+        return id_ in self.index
+
+    def ids(self):
+        return list(self.index)
+
+    def get(self, id_):
+        with self._lock:
+            offset, length = self.index[id_]
+            return os.pread(self._file.fileno(), length, offset)
+
+    def _append(self, op, id_, payload=b""):
+        id_bytes = id_.encode()
+        body = id_bytes + payload
+        record = HEADER.pack(zlib.crc32(bytes([op]) + body), len(payload),
+                             op, len(id_bytes)) + body
+        with self._lock:
+            offset = self.size
+            self._file.write(record)
+            self.size += len(record)
+            self._apply(self.index, op, id_,
+                        offset + HEADER.size + len(id_bytes), len(payload))
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                self.sync()
+            self._maybe_compact()
+
+    def put(self, id_, payload):
+        self._append(PUT, id_, payload)
+
+    def delete(self, id_):
+        if id_ not in self.index:
+            raise KeyError(id_)
+        self._append(DELETE, id_)
+
+    def sync(self):
+        with self._lock:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def _maybe_compact(self):
+        garbage = self.size - self.live_size
+        if (garbage > self.compact_min_size
+                and garbage > self.compact_ratio * self.size
+                and self._compaction is None):
+            self._compaction = threading.Thread(target=self.compact,
+                                                daemon=True)
+            self._compaction.start()
+
+    def compact(self):
+        """ rewrite the live records into a new file, then swap files. The
+        log being append-only, records written during the copy are found
+        after the copied size and replayed under the lock. """
+        tmp_path = self.path + ".compact"
+        with self._lock:
+            self.sync()
+            snapshot = dict(self.index)
+            end = self.size
+        index = {}
+        with open(tmp_path, "wb") as tmp:
+            for id_, (offset, length) in snapshot.items():
+                id_bytes = id_.encode()
+                start = offset - len(id_bytes) - HEADER.size
+                size = self._record_size(id_bytes, length)
+                index[id_] = (tmp.tell() + size - length, length)
+                tmp.write(os.pread(self._file.fileno(), size, start))
+            with self._lock:
+                tail = list(self._iter_records(self._file, end, self.size))
+                for offset, op, id_, payload_offset, length in tail:
+                    size = payload_offset + length - offset
+                    index.pop(id_, None)
+                    if op == PUT:
+                        index[id_] = (tmp.tell() + size - length, length)
+                    tmp.write(os.pread(self._file.fileno(), size, offset))
+                tmp.flush()
+                os.fsync(tmp.fileno())
+                os.replace(tmp_path, self.path)
+                self._file.close()
+                self._file = open(self.path, "a+b", buffering=0)
+                self.index = index
+                self.size = os.path.getsize(self.path)
+                self.live_size = sum(
+                    self._record_size(id_.encode(), length)
+                    for id_, (_, length) in index.items())
+                self._compaction = None
+
+    def close(self):
+        if self._compaction is not None:
+            self._compaction.join()
+        self.sync()
+        self._file.close()
+
+
+class JournalDAO(data.EntryDAO):
+    """ EntryDAO over a Journal of documents encoded with `codec_name`.
+    Documents of either codec are read, so the codec of a journal can be
+    changed at any time. If the journal does not exist yet, it is created
+    from the data file of a JsonDAO at `migrate_from`. The info of each
+    document is kept in memory once read or written, for get_info. """
+    def __init__(self, journal_path=default_journal_path,
+                 migrate_from=data.default_data_path, codec_name="json",
+                 **journal_options):
+        super().__init__()
+        self.codec = codec.get_codec(codec_name)
+        migrate = (migrate_from is not None and os.path.exists(migrate_from)
+                   and not os.path.exists(journal_path))
+        self.journal = Journal(journal_path, **journal_options)
+        self._sorted_ids = None
+        self._infos = {}  # id -> info, of the documents read or written
+        if migrate:
+            migrate_json(migrate_from, self.journal, self.codec)
+        self.ids = data.IdAllocator.from_ids(self.journal.ids())
+
+    def _get_doc(self, id_):
+        try:
+            return codec.loads(self.journal.get(id_))
+        except KeyError:
+            raise data.EntryNotFoundError()
+
+    def get_entry(self, id_, langs=None):
+        return data.Entry.from_dict(self._get_doc(id_), langs)
+
+    def get_info(self, id_):
+        info = self._infos.get(id_)
+        if info is None:
+            info = self._infos[id_] = self._get_doc(id_)["info"]
+        return info
+
+    def write_entry(self, id_, entry, touch=True):
+        if id_ not in self.journal:
+            self._sorted_ids = None
+            self.ids.reserve(id_)
+        if touch:
+            entry.touch()
+        doc = entry.to_dict()
+        if entry.partial and id_ in self.journal:
+            doc = data.merge_partial(self._get_doc(id_), doc)
+        self.journal.put(id_, self.codec.dumps(doc))
+        self._infos[id_] = doc["info"]
+        self._changed(id_)
+
+    def add_entry(self, entry):
+        new_id = self.ids.allocate()
+        self.write_entry(new_id, entry)
+        return new_id
+
+    def delete_entry(self, id_):
+        try:
+            self.journal.delete(id_)
+        except KeyError:
+            raise data.EntryNotFoundError()
+        self._infos.pop(id_, None)
+        self.ids.release(id_)
+        self._sorted_ids = None
+        self._changed(id_)
+
+    def list_summaries(self, limit=20, after=None, before=None):
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.journal.ids(), key=data.id_sort_key)
+        page_ids = data.fetch_page_ids(self._sorted_ids, limit, after, before)
+        return data.Page.from_fetched(self.get_summaries(page_ids), limit,
+                                      after, before)
+
+    def get_summaries(self, ids):
+        return [data.EntrySummary.from_dict(id_, self._get_doc(id_))
+                for id_ in ids]
+
+    def commit(self):
+        self.journal.sync()
+
+
+def migrate_json(json_path, journal, doc_codec=codec.JsonCodec):
+    texts = data.JsonDAO(json_path).texts
+    for id_, doc in texts.items():
+        journal.put(id_, doc_codec.dumps(doc))
+    journal.sync()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_migrate = subparsers.add_parser("migrate")
+    parser_migrate.add_argument("json_path")
+    parser_migrate.add_argument("journal_path", nargs="?",
+                                default=default_journal_path)
+    parser_migrate.add_argument("--codec", default="json",
+                                choices=sorted(codec.CODECS))
+    parser_compact = subparsers.add_parser("compact")
+    parser_compact.add_argument("journal_path", nargs="?",
+                                default=default_journal_path)
+    args = parser.parse_args()
+
+    journal = Journal(args.journal_path)
+    if args.command == "migrate":
+        migrate_json(args.json_path, journal, codec.get_codec(args.codec))
+    elif args.command == "compact":
+        journal.compact()
+    print(f"{len(journal.index)} entries, {journal.size} bytes")
+    journal.close()
@@ -1,44 +1,230 @@
-from flask import Flask, render_template
-import operator
-import collections
+from flask import (Flask, Response, render_template, request,
+                   stream_with_context, url_for)
+from urllib.parse import quote
+from werkzeug.http import is_resource_modified
+import datetime
+import functools
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import cache
 import data
-from data import DAO
+
+DAO = data.get_dao()  # see data.dao_from_url for LANG_DAO
 
 app = Flask(__name__)
 
+SEGMENTS_FIRST = 20  # segments rendered with the page, then fetched by scroll
+SEGMENTS_MAX = 200
+STREAM_CHUNK_SIZE = 64 * 2**10  # characters
+# streamed compare pages render every segment at once, without the cache
+app.config["STREAM_RENDER"] = int(os.environ.get("LANG_STREAM_RENDER", 0))
+app.jinja_env.globals["zip"] = zip
+
+render_cache = cache.RenderCache(
+    cache.LRUCache(max_items=int(os.environ.get("LANG_CACHE_ITEMS", 256)),
+                   max_bytes=int(os.environ.get("LANG_CACHE_BYTES", 64 * 2**20))),
+    cache.DiskCache(
+        os.environ["LANG_CACHE_DIR"],
+        max_bytes=int(os.environ.get("LANG_CACHE_DIR_BYTES", 2**30)),
+        max_files=int(os.environ.get("LANG_CACHE_DIR_FILES", 100000)))
+    if os.environ.get("LANG_CACHE_DIR") else None,
+)
+DAO.on_change(render_cache.invalidate)
+# entries decoded for the compare views, with their segment pairs, so that
+# each scroll window is only sliced from them; sized in tokens
+segments_cache = cache.LRUCache(
+    max_items=int(os.environ.get("LANG_SEGMENTS_CACHE_ITEMS", 16)),
+    max_bytes=int(os.environ.get("LANG_SEGMENTS_CACHE_TOKENS", 2 * 10**6)),
+    size=lambda value: value[0].text_src.n_tokens + sum(
+        value[0].get_text(lang).n_tokens for lang in value[0].target_langs))
+DAO.on_change(segments_cache.invalidate)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_SIZE = 1024
+COMPRESSORS = {"gzip": gzip.compress}
+if brotli is not None:
+    COMPRESSORS["br"] = brotli.compress
+
+
+def best_encoding(size):
+    if size < MIN_COMPRESS_SIZE:
+        return None
+    return request.accept_encodings.best_match(["br", "gzip"] if brotli else ["gzip"])
+
+
+def no_params(args):
+    return ()
+
+
+def cached(mimetype="text/html", params=no_params):
+    """ serve the body rendered by the view from `render_cache`, keyed by
+    entry id, view and its arguments, the query parameters it reads as
+    normalized by `params(request.args)` (a tuple), entry revision and
+    content key (ids of deleted entries are reused, revisions start again),
+    along with its compressed variants. Other query parameters do not make
+    new keys. Conditional requests are answered from the entry info only;
+    the ETag is weak, being shared by every Content-Encoding. """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(t_id=None, **kwargs):
+            try:
+                info = DAO.get_info(t_id)
+            except data.EntryNotFoundError:
+                return f"entry `{t_id}` not found", 404
+            key = (t_id, request.endpoint, tuple(sorted(kwargs.items())),
+                   params(request.args), info.get("rev", 0), info.get("key"))
+            etag = hashlib.sha1(repr(key).encode()).hexdigest()
+            last_modified = (None if info.get("mtime") is None else
+                             datetime.datetime.fromtimestamp(
+                                 info["mtime"], datetime.timezone.utc))
+            if not is_resource_modified(request.environ, etag=etag,
+                                        last_modified=last_modified):
+                response = Response(status=304)
+            else:
+                body = render_cache.get(key)
+                rendered = None
+                if body is None:
+                    rendered = view(t_id=t_id, **kwargs)
+                    if isinstance(rendered, str):
+                        body = rendered.encode()
+                        render_cache.put(key, body)
+                if isinstance(rendered, Response):  # streamed, not cached
+                    response = rendered
+                elif body is None:  # error
+                    return rendered
+                else:
+                    encoding = best_encoding(len(body))
+                    if encoding is not None:
+                        body_raw = body
+                        body = render_cache.get(key + (encoding,))
+                        if body is None:
+                            body = COMPRESSORS[encoding](body_raw)
+                            render_cache.put(key + (encoding,), body)
+                    response = Response(body, mimetype=mimetype)
+                    if encoding is not None:
+                        response.content_encoding = encoding
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.vary.add("Accept-Encoding")
+            return response
+        return wrapper
+    return decorator
+
+
+@app.after_request
+def conditional(response):
+    """ ETag and compression for responses not served by `cached`. The ETag
+    is of the body before compression, so weak. """
+    if (request.method != "GET" or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed
+            or "ETag" in response.headers):
+        return response
+    response.add_etag(weak=True)
+    response.make_conditional(request)
+    if response.status_code == 200:
+        encoding = best_encoding(response.content_length or 0)
+        if encoding is not None:
+            response.set_data(COMPRESSORS[encoding](response.get_data()))
+            response.content_encoding = encoding
+        response.vary.add("Accept-Encoding")
+    return response
 
-def apply_map(sent0, sent1, map_, line_n):
-    def tag(sent, sent_n, map_):
-        isent_to_tag = collections.defaultdict(lambda: "group-None")
-        for igroup, isents in enumerate(map(operator.itemgetter(sent_n), map_)):
-            for isent in isents:
-                isent_to_tag[isent] = f"group-{line_n}-{igroup}"
-        return [[word, isent_to_tag[isent]] for isent, word in enumerate(sent)]
 
-    return tag(sent0, 0, map_), tag(sent1, 1, map_)
+def tag_segment(text, index, start, end):
+    """ yield (word, tag) for the words `start` to `end` of `text` """
+    igroups = itertools.chain(index[start:end], itertools.repeat(-1))
+    for word, igroup in zip(text.tokens[start:end], igroups):
+        yield word, f"group-{igroup}" if igroup >= 0 else "group-None"
+
+
+def iter_segments(entry, target, pairs):
+    """ tagged segments of source and target, as two generators, for
+    `pairs` of bounds from Entry.segment_pairs """
+    text_src, text_tgt = entry.text_src, entry.get_text(target)
+    index_src, index_tgt = entry.get_map(target).index
+    return ((tag_segment(text_src, index_src, *bounds_src)
+             for bounds_src, _ in pairs),
+            (tag_segment(text_tgt, index_tgt, *bounds_tgt)
+             for _, bounds_tgt in pairs))
+
+
+def segmented(t_id, target):
+    """ (entry with only `target`, its Entry.segment_pairs), computed once
+    per revision. Raises EntryNotFoundError, or KeyError if `target` is not
+    a target language of the entry. """
+    info = DAO.get_info(t_id)
+    key = (t_id, target, info.get("rev", 0), info.get("key"))
+    value = segments_cache.get(key)
+    if value is None:
+        entry = DAO.get_entry(t_id, langs=[target])
+        if target not in entry.target_langs:
+            raise KeyError(target)
+        value = (entry, entry.segment_pairs(target))
+        segments_cache.put(key, value)
+    return value
+
+
+def stream_template(template_name, chunk_size=STREAM_CHUNK_SIZE, **context):
+    """ render the template lazily, yielding chunks of about `chunk_size`
+    characters """
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+
+    def generate():
+        chunk, size = [], 0
+        for piece in template.generate(context):
+            chunk.append(piece)
+            size += len(piece)
+            if size >= chunk_size:
+                yield "".join(chunk)
+                chunk, size = [], 0
+        if chunk:
+            yield "".join(chunk)
+    return Response(stream_with_context(generate()), mimetype="text/html")
 
 
 @app.route('/')
 def diff():
-    def td(entry_id):
-        entry, _id = entry_id
-        size = 32
-        beginning = (entry.text_src.str[:size] +
-                     "..." * (len(entry.text_src.str) > size))
+    def td(summary):
+        _id = summary.id
         langs = ", ".join(map(lambda lg: f"<a href='/{_id}/{lg}'>{lg}</a>",
-                          entry.target_langs))
+                          summary.target_langs))
         return (f"<td>{_id}</td>"
-                f"<td><a href='/{_id}'>{beginning}</a></td>"
-                f"<td>{entry.lang_src}</td>"
+                f"<td><a href='/{_id}'>{summary.beginning}</a></td>"
+                f"<td>{summary.lang_src}</td>"
                 f"<td>{langs}</td>")
+
+    # filters: ?src=<lang> and/or ?target=<lang>
+    filters = {key: request.args[key] for key in ("src", "target")
+               if request.args.get(key)}
+    page = DAO.find(**filters, limit=20,
+                    after=request.args.get("after"),
+                    before=request.args.get("before"))
+    query = "".join(f"&{key}={quote(value)}" for key, value in filters.items())
+    nav = []
+    if page.has_prev:
+        nav.append(f"<a href='/?before={quote(str(page.first_id))}{query}'>"
+                   "prev</a>")
+    if page.has_next:
+        nav.append(f"<a href='/?after={quote(str(page.last_id))}{query}'>"
+                   "next</a>")
     return ("<table>" +
             "<th>id</th><th>text</th><th>src</th><th>targets</th>" +
             "".join(map(lambda s: f"<tr>{s}</tr>",
-                    map(td, DAO.iter_all(limit=20)))) +
-            "</table>")
+                    map(td, page.items))) +
+            "</table>" +
+            " ".join(nav))
 
 
 @app.route("/<t_id>")
+@cached()
 def text(t_id=None):
     try:
         entry = DAO.get_entry(t_id)
@@ -53,46 +239,83 @@ def text(t_id=None):
     return s + l
 
 
+@app.route("/stats/cache")
+def cache_stats():
+    return {**render_cache.stats(), "segments": segments_cache.stats()}
+
+
+def langs_param(args):
+    return (args.get("langs"),)
+
+
 @app.route("/api/<t_id>")
+@cached(mimetype="application/json", params=langs_param)
 def api_json(t_id=None):
-    return DAO.get_entry(t_id).to_dict()
+    langs = request.args.get("langs")
+    try:
+        entry = DAO.get_entry(t_id, langs.split(",") if langs else None)
+    except data.EntryNotFoundError:
+        return f"entry `{t_id}` not found", 404
+    return json.dumps(entry.to_dict())
 
 
-@app.route("/<t_id>/<target>")
-def compare_line(target=None, t_id=None):
+def stream_param(args):
+    return (args.get("stream", app.config["STREAM_RENDER"], type=int),)
+
+
+def window_params(args):
+    """ (start, count) of a window of segments """
+    start = max(args.get("start", 0, type=int), 0)
+    count = max(min(args.get("count", SEGMENTS_FIRST, type=int),
+                    SEGMENTS_MAX), 0)
+    return start, count
+
+
+def render_compare(template, t_id, target):
     try:
-        entry = DAO.get_entry(t_id)
+        entry, pairs = segmented(t_id, target)
     except data.EntryNotFoundError:
         return f"entry `{t_id}` not found", 404
-    tokens_src = [entry.text_src.tokens]
-    tokens_tgt = [entry.get_text(target).tokens]
-    maps = [entry.get_map(target)]
-    text_src = []
-    text_tgt = []
-    for line, (sent0, sent1, map_) in enumerate(zip(tokens_src,
-                                                    tokens_tgt,
-                                                    maps)):
-        tagged_0, tagged_1 = apply_map(sent0, sent1, map_, line)
-        text_src.append(tagged_0)
-        text_tgt.append(tagged_1)
-    return render_template("index.html", text_src=text_src, text_tgt=text_tgt)
+    except KeyError:
+        return f"entry `{t_id}` has no {target}", 404
+    total = len(pairs)
+    stream, = stream_param(request.args)
+    stop = total if stream else min(SEGMENTS_FIRST, total)
+    segments_src, segments_tgt = iter_segments(entry, target, pairs[:stop])
+    context = dict(segments_src=segments_src, segments_tgt=segments_tgt,
+                   next_start=stop if stop < total else None,
+                   segments_url=url_for("api_segments", t_id=t_id, target=target))
+    if stream:
+        return stream_template(template, **context)
+    return render_template(template, **context)
 
 
-@app.route("/<t_id>/<target>/sided")
-def compare_side(target=None, t_id=None):
+@app.route("/api/<t_id>/<target>/segments")
+@cached(mimetype="application/json", params=window_params)
+def api_segments(target=None, t_id=None):
+    start, count = window_params(request.args)
     try:
-        entry = DAO.get_entry(t_id)
+        entry, pairs = segmented(t_id, target)
     except data.EntryNotFoundError:
         return f"entry `{t_id}` not found", 404
-    tokens_src = [entry.text_src.tokens]
-    tokens_tgt = [entry.get_text(target).tokens]
-    maps = [entry.get_map(target)]
-    text_src = []
-    text_tgt = []
-    for line, (sent0, sent1, map_) in enumerate(zip(tokens_src,
-                                                    tokens_tgt,
-                                                    maps)):
-        tagged_0, tagged_1 = apply_map(sent0, sent1, map_, line)
-        text_src.append(tagged_0)
-        text_tgt.append(tagged_1)
-    return render_template("sided.html", text_src=text_src, text_tgt=text_tgt)
+    except KeyError:
+        return f"entry `{t_id}` has no {target}", 404
+    total = len(pairs)
+    segments_src, segments_tgt = iter_segments(entry, target,
+                                               pairs[start:start + count])
+    return json.dumps({"start": start, "total": total,
+                       "segments": [{"src": list(src), "tgt": list(tgt)}
+                                    for src, tgt in zip(segments_src,
+                                                        segments_tgt)]})
+
+
+@app.route("/<t_id>/<target>")
+@cached(params=stream_param)
+def compare_line(target=None, t_id=None):
+    return render_compare("index.html", t_id, target)
+
+
+@app.route("/<t_id>/<target>/sided")
+@cached(params=stream_param)
+def compare_side(target=None, t_id=None):
+    return render_compare("sided.html", t_id, target)
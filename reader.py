@@ -1,11 +1,22 @@
 import argparse
+import collections
+import concurrent.futures
+import glob
+import itertools
+import mmap
+import os
 import pprint
 import operator
 import re
+import time
 
 import data
+import tokenizer
 
 RE_LANG = re.compile(r"\[([a-z0-9-]*)\]")
+LANG_LINE = rb"\[([a-z0-9-]*)\]"
+STREAM_SIZE = 64 * 2**20  # files larger than this are parsed as a stream
+PARSE_AHEAD = 4  # files parsed ahead of the import, per worker
 
 
 def is_lang(s):
@@ -48,12 +59,226 @@ def read(file_path):
     return tuple(lang_texts)
 
 
+def _lines_pattern(delimiter=None):
+    """ lines holding a language tag, or the delimiter if any """
+    line = (LANG_LINE if delimiter is None else
+            b"(?:" + LANG_LINE + b"|" + re.escape(delimiter.encode()) + b")")
+    return re.compile(rb"^[^\S\n]*" + line + rb"[^\S\n]*$", re.MULTILINE)
+
+
+def _decode_entry(mm, offset, texts):
+    lang_texts = []
+    for lang, start, end in texts:
+        if start < end:
+            try:
+                lang_texts.append((lang.decode(), str(mm[start:end], "utf-8")))
+            except UnicodeDecodeError as e:
+                return offset, None, f"invalid utf-8 at byte {start + e.start}"
+    if not lang_texts:
+        return offset, None, "no text"
+    return offset, tuple(lang_texts), None
+
+
+def iter_entries(file_path, delimiter=None):
+    """ parse a file holding several entries formatted as for `read`. An
+    entry ends at a `delimiter` line, or when the language of its first text
+    appears again. Entries are yielded one at a time, as (byte offset of the
+    entry, ((lang0, text0), ...), error), with either the texts or the error
+    set. The file is memory-mapped and scanned with a regex. """
+    pattern = _lines_pattern(delimiter)
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            texts = []  # [lang, start, end] of the texts of the entry
+            offset = None
+            for match in pattern.finditer(mm):
+                if texts:
+                    texts[-1][2] = match.start()
+                lang = match.group(1)
+                if texts and (lang is None or lang == texts[0][0]):
+                    yield _decode_entry(mm, offset, texts)
+                    texts = []
+                if lang is not None:
+                    if not texts:
+                        offset = match.start()
+                    texts.append([lang, min(match.end() + 1, len(mm)), None])
+            if texts:
+                texts[-1][2] = len(mm)
+                yield _decode_entry(mm, offset, texts)
+
+
+def list_files(pattern):
+    """ files of a directory (recursively), or matching a glob pattern """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "**", "*")
+    return sorted(path for path in glob.glob(pattern, recursive=True)
+                  if os.path.isfile(path))
+
+
+def iter_parsed(path, tokenize_texts=False, delimiter=None):
+    """ yield (((lang, text, tokens), ...), error) for each entry of `path` """
+    n_entries = 0
+    try:
+        for offset, lang_texts, error in iter_entries(path, delimiter):
+            n_entries += 1
+            if error is not None:
+                yield None, f"byte {offset}: {error}"
+            else:
+                yield tuple((lang, txt, tokenizer.tokenize_manually(txt)
+                             if tokenize_texts else None)
+                            for lang, txt in lang_texts), None
+    except OSError as e:
+        yield None, f"{type(e).__name__}: {e}"
+    else:
+        if not n_entries:
+            yield None, "no language detected"
+
+
+def parse_file(path, tokenize_texts=False, delimiter=None):
+    """ (path, [(texts, error) for each entry]), run in worker processes """
+    return path, list(iter_parsed(path, tokenize_texts, delimiter))
+
+
+def parse_ahead(executor, paths, window, tokenize_texts=False,
+                delimiter=None):
+    """ yield parse_file of each of `paths`, in order, with at most `window`
+    files submitted to `executor` ahead, so that parsed files do not pile
+    up when the DAO writes more slowly than the workers parse """
+    paths = iter(paths)
+    pending = collections.deque(
+        executor.submit(parse_file, path, tokenize_texts, delimiter)
+        for path in itertools.islice(paths, window))
+    while pending:
+        result = pending.popleft().result()
+        for path in itertools.islice(paths, 1):
+            pending.append(executor.submit(parse_file, path, tokenize_texts,
+                                           delimiter))
+        yield result
+
+
+def make_entry(lang_texts):
+    (lang, txt, tokens), *targets = lang_texts
+    entry = data.Entry(data.Text(lang, txt, tokens))
+    for lang, txt, tokens in targets:
+        entry.add(data.Text(lang, txt, tokens))
+    return entry
+
+
+class ImportState:
+    """ files already imported, one path per line, appended once their
+    entries are committed, so that an interrupted import can be resumed """
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.done = set(line.rstrip("\n") for line in f)
+
+    def mark_done(self, paths):
+        self.done.update(paths)
+        if self.path is not None:
+            with open(self.path, "a") as f:
+                f.writelines(f"{path}\n" for path in paths)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def import_files(dao, paths, state, batch_size=500, workers=None,
+                 tokenize_texts=False, delimiter=None, merge=False,
+                 dry_run=False, log=print):
+    """ parse `paths` in a process pool and import their entries to `dao`
+    by batches, as they are parsed (see parse_ahead), see EntryDAO.import_entries for `merge` and `dry_run`.
+    Files bigger than STREAM_SIZE are streamed in this process instead.
+    Returns ({path: [errors]} for entries that could not be parsed, Counter
+    of new, changed and unchanged entries). """
+    paths = [path for path in paths if path not in state.done]
+    big_paths = [path for path in paths if os.path.getsize(path) > STREAM_SIZE]
+    small_paths = sorted(set(paths) - set(big_paths))
+    errors = {}
+    report = collections.Counter()
+    batch, batch_paths = [], []
+    n_files = n_entries = 0
+    start = time.perf_counter()
+
+    def flush():
+        nonlocal n_entries
+        if batch:
+            report.update(dao.import_entries(batch, merge, dry_run))
+        if not dry_run:
+            if hasattr(dao, "commit"):
+                dao.commit()
+            state.mark_done(batch_paths)
+        n_entries += len(batch)
+        batch.clear()
+        batch_paths.clear()
+        elapsed = time.perf_counter() - start
+        log(f"{n_files}/{len(paths)} files, {n_entries} entries "
+            f"({report['new']} new, {report['changed']} changed, "
+            f"{report['unchanged']} unchanged), {n_files / elapsed:.1f} "
+            f"files/s, {n_entries / elapsed:.1f} entries/s")
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        window = PARSE_AHEAD * (workers or os.cpu_count() or 1)
+        results = itertools.chain(
+            parse_ahead(executor, small_paths, window, tokenize_texts,
+                        delimiter),
+            ((path, iter_parsed(path, tokenize_texts, delimiter))
+             for path in big_paths))
+        for path, parsed in results:
+            n_files += 1
+            for lang_texts, error in parsed:
+                if error is not None:
+                    errors.setdefault(path, []).append(error)
+                    continue
+                batch.append(make_entry(lang_texts))
+                if len(batch) >= batch_size:
+                    flush()
+            if path not in errors:  # otherwise retried on resume
+                batch_paths.append(path)
+    if batch or batch_paths:
+        flush()
+    return errors, report
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--new", action="store_true")
+    parser.add_argument("--batch", action="store_true",
+                        help="import every file of a directory or glob")
+    parser.add_argument("--tokenize", action="store_true",
+                        help="tokenize texts with tokenizer.tokenize_manually")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--state", default=None,
+                        help="file recording imported files, to resume")
+    parser.add_argument("--delimiter", default=None,
+                        help="line separating entries in a file, by default "
+                        "an entry ends when its source language reappears")
+    parser.add_argument("--merge", action="store_true",
+                        help="update entries already imported whose content "
+                        "changed with their new or changed languages, "
+                        "instead of skipping them")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only report how many entries are new, changed "
+                        "or unchanged")
     parser.add_argument("path")
     args = parser.parse_args()
 
+    if args.batch:
+        paths = list_files(args.path)
+        state = ImportState(args.state)
+        errors, report = import_files(
+            data.DAO, paths, state, args.batch_size, args.workers,
+            args.tokenize, args.delimiter, args.merge, args.dry_run)
+        for path, path_errors in errors.items():
+            for error in path_errors:
+                print(f"Could not parse {path}, {error}")
+        print(f"{report['new']} new, {report['changed']} changed, "
+              f"{report['unchanged']} unchanged entries"
+              + " (dry run)" * args.dry_run)
+        print(f"{len(errors)} files not fully imported.")
+
     if args.new:
         try:
             lang_texts = read(args.path)
@@ -63,14 +288,18 @@ if __name__ == "__main__":
             exit(1)
         lang, txt = lang_texts[0]
         print(f"Found texts for: {'/'.join(map(operator.itemgetter(0), lang_texts))}."
-              " Using {lang} as src.")
+              f" Using {lang} as src.")
         text_src = data.Text(lang, txt)
         entry = data.Entry(text_src)
         for lang, txt in lang_texts[1:]:
             entry.add(data.Text(lang, txt))
-        new_id = data.add_entry(entry)
         pprint.pprint(entry.to_dict())
         print()
-        if input("Save? [y/N]") in ("y", "Y"):
-            data.commit()
+        existing_id = data.DAO.get_id_by_key(entry.key)
+        if existing_id is not None:
+            print(f"This source text is already saved with id {existing_id}")
+        elif input("Save? [y/N]") in ("y", "Y"):
+            new_id = data.DAO.add_entry(entry)
+            if hasattr(data.DAO, "commit"):
+                data.DAO.commit()
             print(f"Saved new entry with id {new_id}")
@@ -0,0 +1,459 @@
+""" EntryDAO over a SQLite database, in WAL mode: one writer and any number
+of readers, in as many processes, without a server.
+
+Tables:
+    entries: id, source language, revision, modification time, content
+        key and import hash of each entry
+    texts: the text of each language of an entry ("pos" keeps their order,
+        the source first), its tokens as ids of `tokens`, its segments,
+        and for targets the number of groups of the map and the group of
+        every token of each side (see data.Alignment.index)
+    tokens: the distinct tokens of each language
+    alignments: one row per token of each side of each group of a map
+Integer arrays are stored as blobs, little-endian.
+"""
+import argparse
+import array
+import contextlib
+import os
+import sqlite3
+import sys
+import threading
+
+import data
+
+default_sqlite_path = os.path.join(data.data_folder_path, "data.sqlite")
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id TEXT PRIMARY KEY,
+    src TEXT NOT NULL,
+    rev INTEGER NOT NULL DEFAULT 0,
+    mtime INTEGER,
+    key TEXT,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_order ON entries (length(id), id);
+CREATE INDEX IF NOT EXISTS entries_key ON entries (key);
+CREATE INDEX IF NOT EXISTS entries_src ON entries (src, length(id), id);
+CREATE TABLE IF NOT EXISTS texts (
+    entry_id TEXT NOT NULL REFERENCES entries (id) ON DELETE CASCADE,
+    lang TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    tokens BLOB NOT NULL,
+    segments BLOB NOT NULL,
+    n_groups INTEGER,
+    index_src BLOB,
+    index_tgt BLOB,
+    PRIMARY KEY (entry_id, lang)
+);  -- with rowids: the foreign key checks of alignments then only read the
+    -- primary key index, not the rows and their large blobs
+CREATE INDEX IF NOT EXISTS texts_lang ON texts (lang, entry_id);
+CREATE TABLE IF NOT EXISTS tokens (
+    id INTEGER PRIMARY KEY,
+    lang TEXT NOT NULL,
+    token TEXT NOT NULL,
+    UNIQUE (lang, token)
+);
+CREATE TABLE IF NOT EXISTS alignments (
+    entry_id TEXT NOT NULL,
+    lang TEXT NOT NULL,
+    grp INTEGER NOT NULL,
+    side INTEGER NOT NULL,
+    token INTEGER NOT NULL,
+    FOREIGN KEY (entry_id, lang) REFERENCES texts (entry_id, lang)
+        ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS alignments_text ON alignments (entry_id, lang);
+"""
+MAX_VARIABLES = 500  # per IN (...) query
+
+
+def _blob(values, typecode="I"):
+    values = array.array(typecode, values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unblob(blob, typecode="I"):
+    values = array.array(typecode, blob)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _chunks(items, size=MAX_VARIABLES):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SqliteDAO(data.EntryDAO):
+    """ Each thread of each process has its own connection, statements
+    being prepared once per connection (see `cached_statements`). Writes
+    are transactions, with a compare-and-set on the revision as for
+    MongoDAO. Token strings are cached in the process once committed. """
+    def __init__(self, path=default_sqlite_path, timeout=30.0,
+                 cached_statements=256):
+        super().__init__()
+        self.path = path
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._token_ids = {}  # (lang, token) -> id
+        self._token_strs = {}  # id -> token
+        self._ids = None  # IdAllocator, made on first add
+        self.conn.executescript(SCHEMA)
+        self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout,
+                               isolation_level=None,
+                               cached_statements=self.cached_statements)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    @property
+    def conn(self):
+        """ the connection of this thread, made again after a fork """
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.conn = self._connect()
+            local.pid = os.getpid()
+            local.new_tokens = {}
+        return local.conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """ tokens interned in the transaction are cached once it commits """
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            self._local.new_tokens.clear()
+            raise
+        conn.execute("COMMIT")
+        for key, id_ in self._local.new_tokens.items():
+            self._token_ids[key] = id_
+            self._token_strs[id_] = key[1]
+        self._local.new_tokens.clear()
+
+    # tokens
+
+    def _intern(self, conn, lang, tokens):
+        """ ids of `tokens`, added to the table if new """
+        new_tokens = self._local.new_tokens
+        missing = [token for token in dict.fromkeys(tokens)
+                   if (lang, token) not in self._token_ids
+                   and (lang, token) not in new_tokens]
+        if missing:
+            conn.executemany(
+                "INSERT OR IGNORE INTO tokens (lang, token) VALUES (?, ?)",
+                ((lang, token) for token in missing))
+            for chunk in _chunks(missing):
+                rows = conn.execute(
+                    "SELECT token, id FROM tokens WHERE lang = ? AND token IN "
+                    f"({', '.join('?' * len(chunk))})", (lang, *chunk))
+                new_tokens.update(((lang, token), id_) for token, id_ in rows)
+
+        def token_id(token):
+            key = lang, token
+            id_ = self._token_ids.get(key)
+            return new_tokens[key] if id_ is None else id_
+        return list(map(token_id, tokens))
+
+    def _token_strings(self, conn, ids):
+        strs = self._token_strs
+        missing = set(ids).difference(strs)
+        for chunk in _chunks(missing):
+            strs.update(conn.execute(
+                "SELECT id, token FROM tokens WHERE id IN "
+                f"({', '.join('?' * len(chunk))})", chunk))
+        return list(map(strs.__getitem__, ids))
+
+    # writing
+
+    @staticmethod
+    def _position(conn, id_, lang, src):
+        """ 0 for the source, else the position already given to `lang`,
+        else after the last one """
+        if src:
+            return 0
+        row = conn.execute("SELECT pos FROM texts WHERE entry_id = ? AND "
+                           "lang = ? AND pos > 0", (id_, lang)).fetchone()
+        if row is None:
+            row = conn.execute("SELECT coalesce(max(pos), 0) + 1 FROM texts "
+                               "WHERE entry_id = ?", (id_,)).fetchone()
+        return row[0]
+
+    def _write_section(self, conn, id_, lang, d, src=False):
+        pos = self._position(conn, id_, lang, src)
+        conn.execute("DELETE FROM texts WHERE entry_id = ? AND lang = ?",
+                     (id_, lang))
+        token_ids = self._intern(conn, lang, data.section_tokens(d))
+        row = [id_, lang, pos, d["text"], _blob(token_ids),
+               _blob(d["segments"]), None, None, None]
+        if "map" in d:
+            groups = d["map"]
+            packed = (groups if isinstance(groups, dict)
+                      else data.pack_groups(groups))
+            row[6] = len(packed["bounds"][0]) - 1
+            row[7:9] = (_blob(idx, "i") for idx in d["map_index"])
+        conn.execute("INSERT INTO texts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     row)
+        if "map" in d:
+            conn.executemany(
+                "INSERT INTO alignments VALUES (?, ?, ?, ?, ?)",
+                ((id_, lang, igroup, side, token)
+                 for igroup, group in enumerate(data.unpack_groups(packed))
+                 for side in (0, 1) for token in group[side]))
+
+    def _write(self, conn, id_, entry, insert=False, touch=True):
+        """ write `entry` at `id_` if stored at `entry.revision` (or not
+        stored, unless `insert`), else raise RevisionConflictError.
+        Touches `entry` if `touch`, restored on failure. """
+        revision, mtime = entry.revision, entry.mtime
+        row = conn.execute("SELECT rev FROM entries WHERE id = ?",
+                           (id_,)).fetchone()
+        if row is not None and (insert or row[0] != revision):
+            raise data.RevisionConflictError(id_)
+        if touch:
+            entry.touch()
+        try:
+            doc = entry.to_dict()
+            info = doc.pop("info")
+            conn.execute(
+                "INSERT INTO entries (id, src, rev, mtime, key, hash) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+                "src = excluded.src, rev = excluded.rev, "
+                "mtime = excluded.mtime, key = excluded.key, "
+                "hash = excluded.hash",
+                (id_, info["src"], info["rev"], info["mtime"], info["key"],
+                 info["hash"]))
+            if not entry.partial:
+                conn.execute(
+                    "DELETE FROM texts WHERE entry_id = ? AND lang NOT IN "
+                    f"({', '.join('?' * len(entry.langs))})",
+                    (id_, *entry.langs))
+            self._write_section(conn, id_, entry.lang_src, doc.pop("src"),
+                                src=True)
+            for lang, d in doc.items():
+                self._write_section(conn, id_, lang, d)
+        except BaseException:
+            entry.revision, entry.mtime = revision, mtime
+            raise
+
+    def write_entry(self, id_, entry, touch=True):
+        """ replaces the entry (only its sections if `entry` is partial)
+        if still at `entry.revision`, else raise RevisionConflictError """
+        with self._transaction() as conn:
+            self._write(conn, id_, entry, touch=touch)
+            if self._ids is not None:
+                self._ids.reserve(id_)
+        self._changed(id_)
+
+    def write_lang(self, id_, entry, lang, src=False):
+        """ only the section of `lang` and, if `src`, the source one """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT rev FROM entries WHERE id = ?",
+                               (id_,)).fetchone()
+            if row is None:
+                raise data.EntryNotFoundError()
+            if row[0] != entry.revision:
+                raise data.RevisionConflictError(id_)
+            revision, mtime = entry.revision, entry.mtime
+            entry.touch()
+            try:
+                conn.execute(
+                    "UPDATE entries SET rev = ?, mtime = ? WHERE id = ?",
+                    (entry.revision, entry.mtime, id_))
+                if src:
+                    self._write_section(conn, id_, entry.lang_src,
+                                        entry.text_src.to_dict(), src=True)
+                self._write_section(conn, id_, lang, entry.section(lang))
+            except BaseException:
+                entry.revision, entry.mtime = revision, mtime
+                raise
+        self._changed(id_)
+
+    def _allocator(self, conn):
+        if self._ids is None:
+            self._ids = data.IdAllocator.from_ids(
+                id_ for id_, in conn.execute("SELECT id FROM entries"))
+        return self._ids
+
+    def add_entries(self, entries):
+        """ in a single transaction """
+        ids = []
+        with self._transaction() as conn:
+            for entry in entries:
+                while True:
+                    id_ = self._allocator(conn).allocate()
+                    try:
+                        self._write(conn, id_, entry, insert=True)
+                        break
+                    except data.RevisionConflictError:
+                        self._ids = None  # added by another process
+                ids.append(id_)
+        for id_ in ids:
+            self._changed(id_)
+        return ids
+
+    def add_entry(self, entry):
+        return self.add_entries([entry])[0]
+
+    def delete_entry(self, id_):
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM entries WHERE id = ?", (id_,))
+            if cursor.rowcount == 0:
+                raise data.EntryNotFoundError()
+            if self._ids is not None:
+                self._ids.release(id_)
+        self._changed(id_)
+
+    # reading
+
+    @staticmethod
+    def _info(row):
+        src, rev, mtime, key, hash_ = row
+        return {"src": src, "rev": rev, "mtime": mtime, "key": key,
+                "hash": hash_}
+
+    def get_info(self, id_):
+        """ with "langs", from the texts """
+        conn = self.conn
+        row = conn.execute(
+            "SELECT src, rev, mtime, key, hash FROM entries WHERE id = ?",
+            (id_,)).fetchone()
+        if row is None:
+            raise data.EntryNotFoundError()
+        info = self._info(row)
+        info["langs"] = [lang for lang, in conn.execute(
+            "SELECT lang FROM texts WHERE entry_id = ? ORDER BY pos", (id_,))]
+        return info
+
+    def _map(self, conn, id_, lang, n_groups):
+        members, counts = ([], []), ([0] * n_groups, [0] * n_groups)
+        for igroup, side, token in conn.execute(
+                "SELECT grp, side, token FROM alignments "
+                "WHERE entry_id = ? AND lang = ? ORDER BY rowid", (id_, lang)):
+            members[side].append(token)
+            counts[side][igroup] += 1
+        bounds = []
+        for side_counts in counts:
+            side_bounds = [0]
+            for count in side_counts:
+                side_bounds.append(side_bounds[-1] + count)
+            bounds.append(side_bounds)
+        return {"members": list(members), "bounds": bounds}
+
+    def get_entry(self, id_, langs=None):
+        conn = self.conn
+        conn.execute("BEGIN")  # a consistent snapshot of the entry
+        try:
+            info = self.get_info(id_)
+            query = ("SELECT lang, text, tokens, segments, n_groups, "
+                     "index_src, index_tgt FROM texts WHERE entry_id = ?")
+            params = [id_]
+            if langs is not None:
+                query += (f" AND (lang = ? OR lang IN "
+                          f"({', '.join('?' * len(langs))}))")
+                params += [info["src"], *langs]
+            doc = {"info": info}
+            for (lang, text, tokens, segments, n_groups, index_src,
+                 index_tgt) in conn.execute(query + " ORDER BY pos", params):
+                d = {"text": text,
+                     "tokens": self._token_strings(conn, _unblob(tokens)),
+                     "segments": _unblob(segments).tolist()}
+                if n_groups is not None:
+                    d["map"] = self._map(conn, id_, lang, n_groups)
+                    d["map_index"] = [_unblob(index_src, "i"),
+                                      _unblob(index_tgt, "i")]
+                doc["src" if lang == info["src"] else lang] = d
+        finally:
+            conn.execute("COMMIT")
+        return data.Entry.from_dict(doc, langs)
+
+    def list_summaries(self, limit=20, after=None, before=None):
+        return self.find(limit=limit, after=after, before=before)
+
+    def find(self, src=None, target=None, limit=20, after=None, before=None):
+        """ through the indexes on entries.src and texts.lang """
+        query = ("SELECT e.id, e.src, substr(t.text, 1, ?) FROM entries e "
+                 "JOIN texts t ON t.entry_id = e.id AND t.lang = e.src")
+        params = [data.SUMMARY_SIZE + 1]
+        where = []
+        if target is not None:
+            query += (" JOIN texts x ON x.entry_id = e.id AND x.lang = ?"
+                      " AND x.pos > 0")
+            params.append(target)
+        if src is not None:
+            where.append("e.src = ?")
+            params.append(src)
+        if before is None:
+            if after is not None:
+                where.append("(length(e.id), e.id) > (length(?), ?)")
+                params += [after, after]
+            order = "length(e.id), e.id"
+        else:
+            where.append("(length(e.id), e.id) < (length(?), ?)")
+            params += [before, before]
+            order = "length(e.id) DESC, e.id DESC"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += f" ORDER BY {order} LIMIT ?"
+        conn = self.conn
+        rows = conn.execute(query, params + [limit + 1]).fetchall()
+        targets = {}
+        for chunk in _chunks(row[0] for row in rows):
+            for id_, lang in conn.execute(
+                    "SELECT entry_id, lang FROM texts WHERE pos > 0 AND "
+                    f"entry_id IN ({', '.join('?' * len(chunk))}) "
+                    "ORDER BY entry_id, pos", chunk):
+                targets.setdefault(id_, []).append(lang)
+        summaries = [data.EntrySummary(id_, src, beginning,
+                                       [src] + targets.get(id_, []))
+                     for id_, src, beginning in rows]
+        return data.Page.from_fetched(summaries, limit, after, before)
+
+    def get_id_by_key(self, key):
+        row = self.conn.execute("SELECT id FROM entries WHERE key = ?",
+                                (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _find_keys(self, keys):
+        found = {}
+        for chunk in _chunks(keys):
+            for row in self.conn.execute(
+                    "SELECT id, src, rev, mtime, key, hash FROM entries "
+                    f"WHERE key IN ({', '.join('?' * len(chunk))})", chunk):
+                found[row[4]] = (row[0], self._info(row[1:]))
+        return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_migrate = subparsers.add_parser(
+        "migrate", help="copy every entry of a DAO to a database, under the "
+        "same ids")
+    parser_migrate.add_argument(
+        "source", help="url of the DAO to copy, see data.dao_from_url")
+    parser_migrate.add_argument("sqlite_path", nargs="?",
+                                default=default_sqlite_path)
+    parser_migrate.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    dao = SqliteDAO(args.sqlite_path)
+    if args.command == "migrate":
+        copied, skipped = data.copy_entries(data.dao_from_url(args.source),
+                                            dao, args.batch_size)
+        print(f"Copied {copied} entries to {args.sqlite_path}, skipped "
+              f"{skipped} already there")
@@ -0,0 +1,72 @@
+let highlighted = [];
+
+function highlightWordGroup(tagName) {
+    if (tagName != "group-None") {
+        highlighted = Array.from(document.getElementsByClassName(tagName));
+        for (word of highlighted) {
+            word.style.backgroundColor = "yellow";
+        }
+    }
+}
+
+function clearWords() {
+    for (word of highlighted) {
+        word.style.backgroundColor = "transparent";
+    }
+    highlighted = [];
+}
+
+document.addEventListener("mouseover", function (event) {
+    if (event.target.dataset && event.target.dataset.group) {
+        highlightWordGroup(event.target.dataset.group);
+    }
+});
+
+document.addEventListener("mouseout", function (event) {
+    if (event.target.dataset && event.target.dataset.group) {
+        clearWords();
+    }
+});
+
+function makeLine(words, className) {
+    const line = document.createElement("div");
+    line.className = "line " + className;
+    for (const [word, tagName] of words) {
+        const span = document.createElement("span");
+        span.className = "word " + tagName;
+        span.dataset.group = tagName;
+        span.textContent = word;
+        line.append(span, " ");
+    }
+    return line;
+}
+
+// fetch segments from `start` when the #more element gets close to the
+// viewport, and give them to `appendSegment(src, tgt)`
+function watchSegments(url, start, appendSegment, count = 20) {
+    if (start === null) {
+        return;
+    }
+    const more = document.getElementById("more");
+    let loading = false;
+    const observer = new IntersectionObserver(function (entries) {
+        if (!entries[0].isIntersecting || loading) {
+            return;
+        }
+        loading = true;
+        fetch(`${url}?start=${start}&count=${count}`)
+            .then(response => response.json())
+            .then(function (data) {
+                for (const segment of data.segments) {
+                    appendSegment(segment.src, segment.tgt);
+                }
+                start = data.start + data.segments.length;
+                loading = false;
+                observer.unobserve(more);
+                if (start < data.total) {
+                    observer.observe(more);  // fires again if still visible
+                }
+            });
+    }, {rootMargin: "1000px"});
+    observer.observe(more);
+}
@@ -0,0 +1,109 @@
+""" tokenizer against the former char-by-char implementations, kept in
+bench_tokenize for timing """
+import random
+
+import pytest
+
+import tokenizer
+from bench_tokenize import detokenize_lookup, tokenize_manually_chars
+
+EDGE_CASES = ["", " ", "_", "\n", "a", "  ", "a b", " a ", "a_b\nc",
+              "\n\n", "__a__", "<sp>", "a<nl>b", "é ü\t\r\nß", "  x"]
+ALPHABET = "ab é _\n\t<>spnl"
+
+
+def random_strings(n, max_len, seed=0):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_len)))
+            for _ in range(n)]
+
+
+STRINGS = EDGE_CASES + random_strings(500, 50)
+
+
+@pytest.mark.parametrize("s", STRINGS)
+def test_tokenize_manually(s):
+    assert tokenizer.tokenize_manually(s) == tokenize_manually_chars(s)
+
+
+@pytest.mark.parametrize("s", STRINGS)
+def test_detokenize(s):
+    tokens = tokenize_manually_chars(s)
+    assert (tokenizer.detokenize_human(tokens)
+            == detokenize_lookup(tokens, tokenizer.TOKEN_HUMAN))
+    assert (tokenizer.detokenize_nlp(tokens)
+            == detokenize_lookup(tokens, tokenizer.TOKEN_NLP))
+
+
+@pytest.mark.parametrize("s", STRINGS)
+def test_tokenize_manually_offsets(s):
+    tokens, offsets = tokenizer.tokenize_manually_offsets(s)
+    assert tokens == tokenize_manually_chars(s)
+    assert len(offsets) == len(tokens) + 1 and offsets[-1] == len(s)
+    for i, token in enumerate(tokens):
+        assert tokenizer.tokenize_manually(
+            s[offsets[i]:offsets[i + 1]]) == [token]
+
+
+@pytest.mark.parametrize("s", STRINGS)
+def test_token_offsets(s):
+    tokens, offsets = tokenizer.tokenize_manually_offsets(s)
+    assert tokenizer.token_offsets(tokens, s) == offsets
+
+
+@pytest.mark.parametrize("s", STRINGS)
+def test_token_offsets_split(s):
+    """ tokens of str.split, as saved by annotate.py """
+    tokens = s.split()
+    offsets = tokenizer.token_offsets(tokens, s)
+    assert len(offsets) == len(tokens) + 1 and offsets[-1] == len(s)
+    assert list(offsets) == sorted(offsets)
+    for i, token in enumerate(tokens):
+        assert s[offsets[i]:offsets[i + 1]].strip() == token
+
+
+def test_token_offsets_split_punctuation():
+    s = "Hello,  world! (yes)"
+    offsets = tokenizer.token_offsets(s.split(), s)
+    assert list(offsets) == [0, 8, 15, len(s)]
+
+
+@pytest.mark.parametrize("processes", [None, 2])
+def test_many(processes):
+    strings = random_strings(300, 50, seed=1)
+    token_lists = tokenizer.tokenize_many(strings, processes=processes,
+                                          chunksize=16)
+    assert token_lists == list(map(tokenize_manually_chars, strings))
+    assert (tokenizer.detokenize_many(token_lists, processes=processes)
+            == [detokenize_lookup(tokens, tokenizer.TOKEN_HUMAN)
+                for tokens in token_lists])
+    assert (tokenizer.detokenize_many(token_lists, nlp=True,
+                                      processes=processes)
+            == [detokenize_lookup(tokens, tokenizer.TOKEN_NLP)
+                for tokens in token_lists])
+
+
+@pytest.mark.parametrize("tokens, max_size, starts", [
+    ([], 3, []),
+    (["a"], 3, [0]),
+    (["a", "<nl>", "b"], 3, [0, 2]),
+    (["a", "<nl>"], 3, [0]),
+    (["<nl>", "<nl>", "a"], 3, [0, 1, 2]),
+    (list("abcdefg"), 3, [0, 3, 6]),
+    (["a", "b", "<nl>", "c", "d", "e", "f"], 2, [0, 2, 3, 5]),
+])
+def test_segment_starts(tokens, max_size, starts):
+    assert tokenizer.segment_starts(tokens, max_size) == starts
+
+
+@pytest.mark.parametrize("s", random_strings(200, 80, seed=2))
+def test_segment_starts_bounds(s):
+    tokens = tokenizer.tokenize_manually(s)
+    starts = tokenizer.segment_starts(tokens, 7)
+    assert starts == ([0] if tokens else []) + sorted(starts[1:])
+    for start, end in zip(starts, starts[1:] + [len(tokens)]):
+        segment = tokens[start:end]
+        assert 0 < len(segment) <= 7
+        assert tokenizer.NEWLINE not in segment[:-1]
+        if len(segment) < 7 and end < len(tokens):
+            assert segment[-1] == tokenizer.NEWLINE
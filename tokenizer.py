@@ -0,0 +1,113 @@
+import array
+import concurrent.futures
+import itertools
+import re
+
+# tokens
+SEGMENT_SIZE = 200  # max number of tokens in a segment
+
+SPACE = "<sp>"
+NOSPACE = "<nsp>"
+NEWLINE = "<nl>"
+
+TOKEN_HUMAN = {
+        SPACE: " ",
+        NOSPACE: "",
+        NEWLINE: "\n",
+}
+
+TOKEN_NLP = {
+        SPACE: " ",
+        NOSPACE: "_",
+        NEWLINE: "\n",
+}
+
+MANUAL_MAP = {
+        " ": SPACE,
+        "_": NOSPACE,
+        "\n": NEWLINE,
+}
+
+# a separator, or a word
+RE_MANUAL = re.compile("[" + "".join(MANUAL_MAP) + "]|[^" + "".join(MANUAL_MAP) + "]+")
+
+
+def detokenize_human(tokens):
+    return "".join(map(TOKEN_HUMAN.get, tokens, tokens))
+
+
+def detokenize_nlp(tokens):
+    return "".join(map(TOKEN_NLP.get, tokens, tokens))
+
+
+def clear_tokens(tokens):
+    return list(filter(lambda t: t not in TOKEN_HUMAN, tokens))
+
+
+def tokenize_manually(s):
+    """ words, and a token for each of " ", "_" and "\n" """
+    words = RE_MANUAL.findall(s)
+    return list(map(MANUAL_MAP.get, words, words))
+
+
+def tokenize_manually_offsets(s):
+    """ tokens as from tokenize_manually, and the char index in `s` of each
+    token and of the end: token i is s[offsets[i]:offsets[i + 1]] """
+    matches = list(RE_MANUAL.finditer(s))
+    words = [match.group() for match in matches]
+    offsets = array.array("q", (match.start() for match in matches))
+    offsets.append(len(s))
+    return list(map(MANUAL_MAP.get, words, words)), offsets
+
+
+def token_offsets(tokens, s):
+    """ the offsets of tokenize_manually_offsets, for tokens of `s` from
+    any tokenizer: each token is found in `s` from the end of the previous
+    one, a separator token as itself or its character. The text between
+    two tokens, as the whitespace dropped by str.split, goes with the first
+    one, and the text before the first token with it; a token not found
+    is empty. """
+    if detokenize_nlp(tokens) == s:  # tokenize_manually: consecutive
+        lengths = (1 if token in TOKEN_NLP else len(token) for token in tokens)
+        return array.array("q", itertools.accumulate(lengths, initial=0))
+    offsets = array.array("q")
+    end = 0
+    for token in tokens:
+        forms = (token, TOKEN_NLP[token]) if token in TOKEN_NLP else (token,)
+        found = [(i, len(form)) for form in forms
+                 for i in (s.find(form, end),) if i >= 0]
+        start, length = min(found) if found else (end, 0)
+        offsets.append(start)
+        end = start + length
+    if offsets:
+        offsets[0] = 0
+    offsets.append(len(s))
+    return offsets
+
+
+def _map(function, items, processes, chunksize):
+    """ `processes`: None to run here, else number of worker processes (0:
+    one per cpu) """
+    if processes is None:
+        return list(map(function, items))
+    with concurrent.futures.ProcessPoolExecutor(processes or None) as executor:
+        return list(executor.map(function, items, chunksize=chunksize))
+
+
+def tokenize_many(strings, processes=None, chunksize=256):
+    return _map(tokenize_manually, strings, processes, chunksize)
+
+
+def detokenize_many(token_lists, nlp=False, processes=None, chunksize=256):
+    return _map(detokenize_nlp if nlp else detokenize_human, token_lists,
+                processes, chunksize)
+
+
+def segment_starts(tokens, max_size=SEGMENT_SIZE):
+    """ start offsets of the segments of `tokens`: a segment ends after a
+    NEWLINE token, or after `max_size` tokens """
+    starts = [0] if tokens else []
+    for i, token in enumerate(tokens[:-1]):
+        if token == NEWLINE or i + 1 - starts[-1] >= max_size:
+            starts.append(i + 1)
+    return starts